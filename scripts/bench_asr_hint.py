@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Per-utterance ASR time with and without the session language hint.
+
+Transcribes every WAV file of --wav-dir with the worker functions of
+`src.asr` on one in-process WhisperModel: once letting Whisper detect the
+language, as for clients without a profile, and once with the profile's
+language, which skips the detection pass. Both run sequentially and in
+micro-batches of --batch. Prints the per-utterance time distributions and
+how many transcripts came out different as JSON.
+
+运行方式:
+    python3 -m scripts.bench_asr_hint --wav-dir samples/ --language zh \\
+        --model large-v3 --device cuda --repeat 3
+"""
+import argparse
+import json
+import os
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--wav-dir', required=True)
+    parser.add_argument('--language', required=True,
+                        help='language of the recordings, e.g. zh or en')
+    parser.add_argument('--prompt', default='')
+    parser.add_argument('--beam-size', type=int, default=5)
+    parser.add_argument('--model', default='large-v3')
+    parser.add_argument('--device', default='auto')
+    parser.add_argument('--cpu-threads', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--out', help='write the JSON report here as well')
+    return parser.parse_args()
+
+
+def run(blobs, options, repeat, batch):
+    from src import asr
+    from src.metrics import Histogram
+
+    sequential = Histogram('sequential', window=100000)
+    batched = Histogram('batched', window=100000)
+    texts = []
+    for _ in range(repeat):
+        texts = []
+        for blob in blobs:
+            text, period = asr.b_transcribe(blob, options)
+            sequential.observe(period)
+            texts.append(text)
+        for i in range(0, len(blobs), batch):
+            chunk = blobs[i:i + batch]
+            results = asr.b_transcribe_batch(chunk, [options] * len(chunk))
+            # Every utterance of a batch waits for the whole batch
+            for _, period in results:
+                batched.observe(period / len(chunk))
+    return texts, {'sequential': sequential.snapshot(),
+                   'batched': batched.snapshot()}
+
+
+def main():
+    args = parse_args()
+    # Settings are read at import time, no Redis is used here
+    os.environ.setdefault('REDIS_SERVER', 'redis://localhost')
+    from faster_whisper import WhisperModel
+
+    from scripts.bench_replay import load_utterances
+    from src import asr, codec, wire
+    from src.audio import SAMPLE_RATE
+
+    asr._model = WhisperModel(args.model, device=args.device,
+                              compute_type='default',
+                              cpu_threads=args.cpu_threads)
+    blobs = [wire.pack(codec.encode(pcm, SAMPLE_RATE, codec.PCM),
+                       codec=codec.PCM, sample_rate=SAMPLE_RATE)
+             for _, pcm in load_utterances(args.wav_dir)]
+    detect = asr.DecodeOptions(prompt=args.prompt or None,
+                               beam_size=args.beam_size)
+    hint = detect._replace(language=args.language)
+    # The first call pays for lazy initialisation
+    asr.b_transcribe(blobs[0], detect)
+
+    detect_texts, detect_times = run(blobs, detect, args.repeat, args.batch)
+    hint_texts, hint_times = run(blobs, hint, args.repeat, args.batch)
+    report = {
+        'files': len(blobs),
+        'model': args.model,
+        'language': args.language,
+        'detect': detect_times,
+        'hint': hint_times,
+        'speedup': {
+            mode: detect_times[mode]['mean'] / hint_times[mode]['mean']
+            if hint_times[mode]['mean'] else 0.0
+            for mode in ('sequential', 'batched')},
+        # Detection below the confidence threshold drops an utterance, the
+        # hint never does
+        'dropped_without_hint': sum(not t for t in detect_texts)
+        - sum(not t for t in hint_texts),
+        'differing_transcripts': sum(a != b for a, b in zip(detect_texts,
+                                                             hint_texts)),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Bytes per utterance and encode/decode CPU cost of every transport codec,
+for the 16 kHz uplink and the 24 kHz TTS downlink.
+
+运行方式:
+    python3 -m scripts.bench_codec --wav utterance.wav
+    python3 -m scripts.bench_codec --seconds 5
+"""
+import argparse
+import time
+
+import numpy as np
+import soundfile
+
+from src import codec
+from src.audio import SAMPLE_RATE, TTS_SAMPLE_RATE
+
+
+def synthetic_speech(seconds: float, sample_rate: int) -> np.ndarray:
+    """ Harmonic tone with a syllable-rate envelope and a little noise,
+    closer to speech than white noise for the lossless codecs.
+    """
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 140 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    rng = np.random.default_rng(0)
+    signal = 0.2 * voice * envelope + 0.005 * rng.standard_normal(len(t))
+    return signal.astype(np.float32)
+
+
+def bench(samples: np.ndarray, sample_rate: int, repeat: int) -> None:
+    raw = len(samples) * 2
+    print(f'{sample_rate} Hz, {len(samples) / sample_rate:.1f} s, '
+          f'raw PCM {raw} bytes')
+    for name in codec.available():
+        c = codec.CODECS[name]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            payload = codec.encode(samples, sample_rate, c)
+        encode_ms = (time.perf_counter() - start) / repeat * 1000
+        start = time.perf_counter()
+        for _ in range(repeat):
+            codec.decode(payload, c, sample_rate)
+        decode_ms = (time.perf_counter() - start) / repeat * 1000
+        print(f'  {name:<5}{len(payload):>9} bytes  {raw / len(payload):6.1f}x  '
+              f'encode {encode_ms:7.2f} ms  decode {decode_ms:7.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--wav', help='mono utterance to encode')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for sample_rate in (SAMPLE_RATE, TTS_SAMPLE_RATE):
+        if args.wav:
+            samples, sr = soundfile.read(args.wav, dtype='float32')
+            if samples.ndim > 1:
+                samples = samples.mean(axis=1)
+            if sr != sample_rate:
+                idx = np.arange(0, len(samples), sr / sample_rate)
+                samples = np.interp(idx, np.arange(len(samples)), samples
+                                    ).astype(np.float32)
+        else:
+            samples = synthetic_speech(args.seconds, sample_rate)
+        bench(samples, sample_rate, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
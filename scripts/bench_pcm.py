@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Per-utterance overhead of the old tempfile + PyAV path against the
+in-memory PCM path, on both the ASR input and the TTS output side.
+
+运行方式:
+    python3 -m scripts.bench_pcm --n 200 --seconds 5
+"""
+import argparse
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+import soundfile
+from faster_whisper.audio import decode_audio
+
+from src.audio import SAMPLE_RATE, TTS_SAMPLE_RATE, decode_pcm, encode_wav
+
+
+def _timeit(fn, blobs):
+    start = time.perf_counter()
+    for blob in blobs:
+        fn(blob)
+    return (time.perf_counter() - start) / len(blobs) * 1000
+
+
+def asr_tempfile(blob):
+    tmp = tempfile.NamedTemporaryFile(dir=".", suffix=".wav")
+    tmp.write(blob)
+    tmp.flush()
+    audio = decode_audio(tmp.name)
+    tmp.close()
+    return audio
+
+
+def tts_tempfile(wav):
+    tmp = tempfile.NamedTemporaryFile(dir=".", suffix=".wav")
+    soundfile.write(tmp, wav, TTS_SAMPLE_RATE, format="WAV")
+    tmp.seek(0)
+    data = tmp.read()
+    tmp.close()
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pcm = (rng.standard_normal(int(SAMPLE_RATE * args.seconds)) * 3000).astype('<i2')
+    buf = BytesIO()
+    soundfile.write(buf, pcm, SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    utterances = [buf.getvalue()] * args.n
+    tts_out = [rng.uniform(-0.5, 0.5, int(TTS_SAMPLE_RATE * args.seconds)
+                           ).astype(np.float32)] * args.n
+
+    assert np.allclose(decode_pcm(utterances[0]), asr_tempfile(utterances[0]),
+                       atol=1e-4)
+    rows = [
+        ('asr tempfile + PyAV', _timeit(asr_tempfile, utterances)),
+        ('asr np.frombuffer', _timeit(decode_pcm, utterances)),
+        ('tts tempfile + soundfile', _timeit(tts_tempfile, tts_out)),
+        ('tts in-memory wav', _timeit(encode_wav, tts_out)),
+    ]
+    for name, ms in rows:
+        print(f'{name:<28}{ms:8.3f} ms/utterance')
+
+
+if __name__ == '__main__':
+    main()
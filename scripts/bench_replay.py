@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Offline replay benchmark of the server pipeline.
+
+Replays a directory of WAV utterances through the real
+receive_audio -> transcribe -> translate -> tts_and_push path of
+`src.server`, listening on the default room's TTS streams. Redis is
+replaced by fakeredis, and translation and TTS use their stub backends
+with configurable fake latency, so only the ASR model is real. Prints
+utterances per second and the per-stage latency percentiles as JSON, for
+comparing changes run to run.
+
+运行方式 (fakeredis is in requirements-dev.txt):
+    pip install -r requirements-dev.txt
+    python3 -m scripts.bench_replay --wav-dir samples/ --clients 4 \\
+        --repeat 5 --translate-latency 0.3 --tts-latency 0.2 > run.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--wav-dir', required=True)
+    parser.add_argument('--clients', type=int, default=1,
+                        help='virtual speakers the utterances are spread over')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='times every file is replayed')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='utterances sent per second, 0 sends all at once')
+    parser.add_argument('--translate-latency', type=float, default=0.0)
+    parser.add_argument('--tts-latency', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--out', help='write the JSON report here as well')
+    return parser.parse_args()
+
+
+def configure(args):
+    # Settings are read at import time, so they go in before src is imported
+    os.environ.setdefault('REDIS_SERVER', 'redis://fakeredis')
+    os.environ['TRANSLATE_BACKEND'] = 'stub'
+    os.environ['TRANSLATE_STUB_LATENCY'] = str(args.translate_latency)
+    os.environ['TTS_BACKEND'] = 'stub'
+    os.environ['TTS_STUB_LATENCY'] = str(args.tts_latency)
+    os.environ.setdefault('TTS_CACHE_TIER', 'none')
+    os.environ.setdefault('METRICS_PORT', '0')
+    # Utterances are pushed straight onto the audio lists
+    os.environ['INGEST_MODE'] = 'list'
+    # A replay is a deliberate backlog, nothing should be shed by default
+    os.environ.setdefault('AUDIO_DEADLINE_S', '0')
+    os.environ.setdefault('SERVER_QUEUE_MAXLEN', '0')
+    os.environ.setdefault('TTS_QUEUE_MAXLEN', '0')
+
+
+def load_utterances(wav_dir):
+    import soundfile
+
+    from src.audio import SAMPLE_RATE
+    from src.playback import resample
+
+    utterances = []
+    for path in sorted(glob.glob(os.path.join(wav_dir, '*.wav'))):
+        samples, sample_rate = soundfile.read(path, dtype='float32')
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        samples = resample(samples, sample_rate, SAMPLE_RATE)
+        utterances.append((os.path.basename(path),
+                           (np.clip(samples, -1, 1) * 32767).astype('<i2')))
+    if not utterances:
+        sys.exit(f'No .wav files in {wav_dir}')
+    return utterances
+
+
+async def listen(redis, langs, done, pending):
+    """ Read the room's TTS streams like the listening clients would. """
+    from src import tracing, wire
+    from src.protocol import DEFAULT_ROOM, room_key
+
+    offsets = {room_key(DEFAULT_ROOM, lang): '$' for lang in langs}
+    while True:
+        for key, entries in await redis.xread(offsets, block=0):
+            lang = key.decode('utf-8').rsplit(':', 1)[1]
+            for entry_id, fields in entries:
+                offsets[key.decode('utf-8')] = entry_id
+                frame = wire.unpack(fields[b'audio'])
+                trace = frame.trace or {}
+                tracing.observe_playout(tracing.stamp(trace, 'play'))
+                if frame.last and trace.get('id') in pending:
+                    remaining = pending[trace['id']]
+                    remaining.discard(lang)
+                    if not remaining:
+                        del pending[trace['id']]
+                        done.append(time.time())
+
+
+async def replay(args, utterances):
+    import fakeredis
+
+    from src import codec, metrics, protocol, server, tracing, wire
+    from src.audio import SAMPLE_RATE
+    from src.redis_pool import set_redis
+    from src.translate import LANGS
+
+    redis = fakeredis.FakeAsyncRedis()
+    set_redis(redis)
+    server.setup()
+    uuids = [f'bench-{i}' for i in range(args.clients)]
+    for uuid in uuids:
+        await protocol.register_client(redis, uuid, {'codecs': 'pcm'})
+    # The server only translates what another member of the room listens
+    # to; a listener without a language asks for all of them
+    await protocol.register_client(redis, 'bench-listener', {'codecs': 'pcm'})
+
+    done, pending = [], {}
+    tasks = [asyncio.create_task(server.receive_audio())]
+    tasks.append(asyncio.create_task(listen(redis, LANGS, done, pending)))
+
+    sent = 0
+    start = time.time()
+    for r in range(args.repeat):
+        for i, (_, pcm) in enumerate(utterances):
+            uuid = uuids[(r * len(utterances) + i) % len(uuids)]
+            trace = tracing.new_trace(capture=time.time())
+            pending[trace['id']] = set(LANGS)
+            tracing.stamp(trace, 'enqueue')
+            blob = wire.pack(codec.encode(pcm, SAMPLE_RATE, codec.PCM),
+                             seq=sent, codec=codec.PCM,
+                             sample_rate=SAMPLE_RATE, trace=trace)
+            await redis.rpush(protocol.audio_key(uuid), blob)
+            sent += 1
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+
+    deadline = start + args.timeout
+    while pending and time.time() < deadline:
+        await asyncio.sleep(0.05)
+        if not server._client_queues and not any(
+                [await redis.llen(protocol.audio_key(u)) for u in uuids]):
+            # Drained, what is left produced no TTS: its ASR text was empty
+            # or no listener asked for its languages
+            break
+    elapsed = (done[-1] if done else time.time()) - start
+    for task in tasks:
+        task.cancel()
+    server.asr_pool.shutdown()
+
+    snapshot = metrics.snapshot()
+    return {
+        'files': len(utterances),
+        'clients': args.clients,
+        'sent': sent,
+        'completed': len(done),
+        # Utterances transcribed to nothing never produce audio
+        'unfinished': len(pending),
+        'elapsed': elapsed,
+        'utterances_per_second': len(done) / elapsed if elapsed else 0.0,
+        'translate_latency': args.translate_latency,
+        'tts_latency': args.tts_latency,
+        'stages': {k: v for k, v in snapshot.items() if k.startswith('stage.')},
+        'metrics': {k: v for k, v in snapshot.items()
+                    if not k.startswith('stage.')},
+    }
+
+
+def main():
+    args = parse_args()
+    configure(args)
+    report = asyncio.run(replay(args, load_utterances(args.wav_dir)))
+    text = json.dumps(report, indent=2, sort_keys=True, default=str)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
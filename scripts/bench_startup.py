@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Startup time of the server, from launch until every stage is serving.
+
+Starts `python -m src.server` --runs times against the configured Redis,
+polls its `/ready` endpoint and records when each stage (asr, tts, ingest)
+became ready, then stops it with SIGINT. With --clear-cache the compile
+cache is emptied before the first run, so run 1 shows a cold start and the
+later runs what a rolling restart costs with the cache in place. Settings
+such as STARTUP_WARMUP or TTS_COMPILE are passed with --env to compare
+variants.
+
+运行方式:
+    python3 -m scripts.bench_startup --runs 3 --clear-cache \\
+        --env STARTUP_WARMUP=asr,tts --out startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--port', type=int, default=9109)
+    parser.add_argument('--env', action='append', default=[],
+                        help='KEY=VALUE setting for the server, repeatable')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='empty COMPILE_CACHE_DIR before the first run')
+    parser.add_argument('--timeout', type=float, default=1800)
+    parser.add_argument('--out', help='write the JSON report here as well')
+    return parser.parse_args()
+
+
+def ready(port):
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=1) as r:
+            return json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+    except (OSError, ValueError):
+        return None  # not listening yet
+
+
+def start_once(env, port, timeout):
+    launched = time.time()
+    process = subprocess.Popen([sys.executable, '-m', 'src.server'], env=env)
+    status, first_seen = None, {}
+    try:
+        while time.time() - launched < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f'server exited with {process.returncode}')
+            status = ready(port)
+            if status is not None:
+                # Stage times as seen from outside, the server reports its own
+                for stage in status['stages']:
+                    first_seen.setdefault(stage, time.time() - launched)
+                if status['ready']:
+                    break
+            time.sleep(0.2)
+        else:
+            raise TimeoutError(f'not ready after {timeout}s: {status}')
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return {'ready': time.time() - launched if status and status['ready'] else None,
+            'stages': status['stages'] if status else {},
+            'observed': first_seen}
+
+
+def main():
+    args = parse_args()
+    env = dict(os.environ, METRICS_PORT=str(args.port), METRICS_HOST='127.0.0.1')
+    env.update(kv.split('=', 1) for kv in args.env)
+    cache = env.get('COMPILE_CACHE_DIR', '.cache/compile')
+    if args.clear_cache and os.path.isdir(cache):
+        shutil.rmtree(cache)
+
+    runs = []
+    for i in range(args.runs):
+        runs.append(start_once(env, args.port, args.timeout))
+        print(json.dumps({'run': i + 1, **runs[-1]}), flush=True)
+    report = {'runs': runs, 'env': dict(kv.split('=', 1) for kv in args.env),
+              'cleared_cache': args.clear_cache}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Frames per second of the old deque-scan recorder loop against the shared
+`VadSegmenter`, on a recorded 16 kHz mono WAV file (or synthetic bursts of
+noise when none is given). The webrtcvad decisions are computed once up
+front so the numbers compare segmentation cost only; `--with-vad` times the
+full path including webrtcvad. The per-frame scan grows with `--window`,
+the running counters do not.
+
+运行方式:
+    python3 -m scripts.bench_vad --wav recording.wav --repeat 20
+"""
+import argparse
+import collections
+import time
+from io import BytesIO
+
+import numpy as np
+
+from src.audio import SAMPLE_RATE
+from src.vad import FRAME_DURATION, VadSegmenter, to_wav, wav_frames
+
+
+def deque_recorder(frames, is_speech, window):
+    """ The loop the clients and local scripts used before. """
+    utterances = []
+    watcher = collections.deque(maxlen=window)
+    recorded = collections.deque(maxlen=1000)
+    triggered, ratio = False, 0.5
+    for frame in frames:
+        watcher.append((frame, is_speech(frame)))
+        recorded.append(frame)
+        if not triggered:
+            if len([f for f, speech in watcher if speech]) > ratio * watcher.maxlen:
+                triggered = True
+                watcher.clear()
+        elif len([f for f, speech in watcher if not speech]) > ratio * watcher.maxlen:
+            utterances.append(b''.join(recorded))
+            recorded.clear()
+            watcher.clear()
+            triggered = False
+    return utterances
+
+
+def segmenter(frames, is_speech, window):
+    return list(VadSegmenter(window=window, is_speech=is_speech).segments(frames))
+
+
+def synthetic(seconds):
+    rng = np.random.default_rng(0)
+    pcm, t = [], 0.0
+    while t < seconds:
+        speech = rng.uniform(1, 5)
+        silence = rng.uniform(0.5, 2)
+        pcm.append(rng.standard_normal(int(speech * SAMPLE_RATE)) * 6000)
+        pcm.append(rng.standard_normal(int(silence * SAMPLE_RATE)) * 30)
+        t += speech + silence
+    return to_wav(np.concatenate(pcm).astype('<i2').tobytes())
+
+
+def _timeit(fn, frames, is_speech, window, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(frames, is_speech, window)
+    return len(frames) * repeat / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--wav', help='16-bit mono 16 kHz WAV file')
+    parser.add_argument('--seconds', type=float, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mode', type=int, default=1)
+    parser.add_argument('--window', type=int, default=30)
+    parser.add_argument('--with-vad', action='store_true')
+    args = parser.parse_args()
+
+    import webrtcvad
+    vad = webrtcvad.Vad(args.mode)
+    frame_size = SAMPLE_RATE * FRAME_DURATION // 1000
+    source = args.wav or BytesIO(synthetic(args.seconds))
+    frames = list(wav_frames(source, frame_size))
+
+    def live(frame):
+        return vad.is_speech(frame, SAMPLE_RATE)
+
+    decisions = {id(f): live(f) for f in frames}
+
+    def cached(frame):
+        return decisions[id(frame)]
+
+    is_speech = live if args.with_vad else cached
+    print(f'{len(frames)} frames, {len(frames) * FRAME_DURATION / 1000:.0f} s of audio, '
+          f'{sum(decisions.values())} voiced')
+    for name, fn in (('deque scan', deque_recorder), ('VadSegmenter', segmenter)):
+        fps = _timeit(fn, frames, is_speech, args.window, args.repeat)
+        print(f'{name:<16}{fps:12.0f} frames/s'
+              f'{fps * FRAME_DURATION / 1000:10.0f}x realtime'
+              f'{len(fn(frames, is_speech, args.window)):6d} utterances')
+
+
+if __name__ == '__main__':
+    main()
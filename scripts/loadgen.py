@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+Headless multi-client load generator for a running server.
+
+Every virtual client speaks the same Redis protocol as src/client.py:
+it registers in `client_uuids`, pushes traced utterances to
+STS:AUDIOS:{uuid} (or XADDs them to STS:AUDIOSTREAM:{uuid} with
+INGEST_MODE=stream) and reads its room's STS:ROOM:{room}:{lang} stream with
+one blocking XREAD. Clients are spread over --rooms rooms. The server only
+translates into the languages of the other listeners in a room, so an
+utterance nobody can hear is sent but not waited for ("unheard"). Audio
+comes from recorded WAV files instead of PyAudio, taken from
+<wav-dir>/<lang>/ when that exists and from <wav-dir> otherwise.
+
+Clients are added in steps. For every step the report gives completed
+utterances per second, the end-to-end latency distribution (capture to
+first and to last TTS chunk, both on this machine's clock), the
+utterances still unfinished when it ended, which the next step does not
+wait for, and how fast the audio backlog grows. The saturation point is
+the first step whose audio backlog keeps growing or whose p95
+first-audio latency exceeds --slo. In stream mode the backlog is what the
+server group has not read or not acknowledged yet, and every step reports
+how many servers were alive, so runs against one and against several
+servers compare directly.
+
+运行方式:
+    python3 -m scripts.loadgen --wav-dir samples/ --mix en=0.5,zh=0.5 \\
+        --start 10 --step 10 --max-clients 100 --step-seconds 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {value}')
+    return number
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--wav-dir', required=True)
+    parser.add_argument('--mix', default='en=0.5,zh=0.5',
+                        help='client language shares, e.g. en=0.7,zh=0.3')
+    parser.add_argument('--start', type=positive_int, default=10,
+                        help='clients in the first step')
+    parser.add_argument('--step', type=positive_int, default=10,
+                        help='clients added per step')
+    parser.add_argument('--max-clients', type=int, default=100)
+    parser.add_argument('--step-seconds', type=float, default=60)
+    parser.add_argument('--utterances-per-minute', type=float, default=6,
+                        help='average speech rate of one client')
+    parser.add_argument('--rooms', type=positive_int, default=1,
+                        help='rooms the clients are spread over round robin')
+    parser.add_argument('--codec', default='pcm')
+    parser.add_argument('--slo', type=float, default=5.0,
+                        help='p95 capture to first audio, seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the JSON report here as well')
+    return parser.parse_args()
+
+
+def parse_mix(mix):
+    shares = {}
+    for part in mix.split(','):
+        lang, _, share = part.partition('=')
+        shares[lang.strip()] = float(share or 1)
+    return shares
+
+
+def load_audio(wav_dir, langs):
+    from scripts.bench_replay import load_utterances
+
+    audio = {}
+    for lang in langs:
+        path = os.path.join(wav_dir, lang)
+        audio[lang] = [pcm for _, pcm in
+                       load_utterances(path if os.path.isdir(path) else wav_dir)]
+    return audio
+
+
+class Stats:
+    """ Results of one load step. Latencies are recorded once per
+    utterance, by whichever listener hears it first.
+    """
+
+    def __init__(self, clients):
+        from src.metrics import Histogram
+
+        self.clients = clients
+        self.sent = 0
+        self.unheard = 0
+        self.completed = 0
+        self.first_audio = Histogram('first_audio', window=100000)
+        self.last_audio = Histogram('last_audio', window=100000)
+        self.backlog = []  # (t, audio items)
+        self.servers = 0
+        # Utterances heard by some listener and not finished yet
+        self.heard = set()
+
+    def report(self, seconds, slo):
+        audio_growth = 0.0
+        if len(self.backlog) > 1:
+            (t0, a0), (t1, a1) = self.backlog[0], self.backlog[-1]
+            audio_growth = (a1 - a0) / (t1 - t0)
+        first = self.first_audio.snapshot()
+        return {
+            'clients': self.clients,
+            'servers': self.servers,
+            'sent': self.sent,
+            'unheard': self.unheard,
+            'completed': self.completed,
+            'utterances_per_second': self.completed / seconds,
+            'first_audio': first,
+            'last_audio': self.last_audio.snapshot(),
+            'audio_backlog': self.backlog[-1][1] if self.backlog else 0,
+            'audio_backlog_per_second': audio_growth,
+            # A backlog that grows by more than a couple of utterances a
+            # minute is not catching up
+            'saturated': audio_growth > 2 / 60 or first['p95'] > slo,
+        }
+
+
+class VirtualClient:
+
+    def __init__(self, redis, uuid, lang, room, utterances, rate, audio_codec):
+        self.redis = redis
+        self.uuid = uuid
+        self.lang = lang
+        self.room = room
+        self.utterances = utterances
+        self.rate = rate
+        self.codec = audio_codec
+        self.seq = 0
+        self.tasks = []
+
+    async def start(self, peers, stats, pending):
+        from src import codec, protocol
+
+        await protocol.register_client(
+            self.redis, self.uuid,
+            {'codecs': ','.join(codec.available()), 'room': self.room,
+             'lang': self.lang})
+        self.tasks = [asyncio.create_task(self.speak(peers, stats, pending)),
+                      asyncio.create_task(self.listen(stats, pending))]
+
+    async def stop(self):
+        from src import protocol
+
+        for task in self.tasks:
+            task.cancel()
+        await protocol.deregister_client(self.redis, self.uuid)
+
+    async def speak(self, peers, stats, pending):
+        from src import codec, protocol, tracing, wire
+        from src.audio import SAMPLE_RATE
+        from src.config import AUDIO_QUEUE_MAXLEN, INGEST_MODE, QUEUE_TTL
+
+        while True:
+            await asyncio.sleep(random.expovariate(self.rate))
+            pcm = random.choice(self.utterances)
+            trace = tracing.new_trace(capture=time.time())
+            payload = codec.encode(pcm, SAMPLE_RATE, self.codec)
+            tracing.stamp(trace, 'enqueue')
+            blob = wire.pack(payload, seq=self.seq, codec=self.codec,
+                             sample_rate=SAMPLE_RATE, trace=trace)
+            self.seq += 1
+            if any(p.tasks and p.room == self.room and p.lang != self.lang
+                   for p in peers):
+                pending[trace['id']] = trace['capture']
+                stats[0].sent += 1
+            else:
+                stats[0].unheard += 1
+            async with self.redis.pipeline(transaction=False) as pipe:
+                protocol.push_audio(pipe, self.uuid, [blob], INGEST_MODE,
+                                    AUDIO_QUEUE_MAXLEN, QUEUE_TTL)
+                await pipe.execute()
+
+    async def listen(self, stats, pending):
+        from src import wire
+        from src.protocol import room_key
+
+        key, last_id = room_key(self.room, self.lang), '$'
+        while True:
+            replies = await self.redis.xread({key: last_id}, count=100, block=0)
+            for _, entries in replies:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    if fields[b'speaker'].decode('utf-8') != self.uuid:
+                        self.heard(wire.unpack(fields[b'audio']), stats, pending)
+
+    @staticmethod
+    def heard(frame, stats, pending):
+        trace_id = (frame.trace or {}).get('id')
+        capture = pending.get(trace_id)
+        if capture is None:
+            return
+        now, step = time.time(), stats[0]
+        if trace_id not in step.heard:
+            step.heard.add(trace_id)
+            step.first_audio.observe(now - capture)
+        if frame.last:
+            # Finished in some language, other listeners are not waited for
+            del pending[trace_id]
+            step.heard.discard(trace_id)
+            step.last_audio.observe(now - capture)
+            step.completed += 1
+
+
+async def stream_backlog(redis, uuid):
+    """ Entries of a client's audio stream the server group has not read
+    or not acknowledged yet.
+    """
+    from redis.exceptions import ResponseError
+
+    from src.protocol import AUDIO_GROUP, audio_stream_key
+
+    try:
+        groups = await redis.xinfo_groups(audio_stream_key(uuid))
+    except ResponseError:
+        return 0  # nothing sent yet
+    for group in groups:
+        if group['name'] in (AUDIO_GROUP, AUDIO_GROUP.encode('utf-8')):
+            return (group.get('lag') or 0) + group['pending']
+    return await redis.xlen(audio_stream_key(uuid))
+
+
+async def sample_backlog(redis, clients, stats, interval=2.0):
+    from src.config import INGEST_MODE
+    from src.protocol import SERVERS_KEY, audio_key
+
+    while True:
+        await asyncio.sleep(interval)
+        if INGEST_MODE == 'stream':
+            audio = sum([await stream_backlog(redis, c.uuid) for c in list(clients)])
+            stats[0].servers = await redis.zcard(SERVERS_KEY)
+        else:
+            async with redis.pipeline(transaction=False) as pipe:
+                for c in list(clients):
+                    pipe.llen(audio_key(c.uuid))
+                audio = sum(await pipe.execute())
+        stats[0].backlog.append((time.time(), audio))
+
+
+async def run(args):
+    from src.redis_pool import close_redis, get_redis
+
+    random.seed(args.seed)
+    shares = parse_mix(args.mix)
+    audio = load_audio(args.wav_dir, shares)
+    from src import codec
+    audio_codec = codec.CODECS[args.codec]
+    rate = args.utterances_per_minute / 60
+    redis = get_redis()
+
+    clients, pending, steps = [], {}, []
+    stats = [None]  # current step, shared with the client tasks
+    sampler = None
+    try:
+        target = args.start
+        while target <= args.max_clients:
+            while len(clients) < target:
+                lang = random.choices(list(shares), weights=shares.values())[0]
+                client = VirtualClient(redis, f'loadgen-{len(clients)}', lang,
+                                       f'loadgen-{len(clients) % args.rooms}',
+                                       audio[lang], rate, audio_codec)
+                clients.append(client)
+            stats[0] = Stats(len(clients))
+            for client in clients:
+                if not client.tasks:
+                    await client.start(clients, stats, pending)
+            if sampler is None:
+                sampler = asyncio.create_task(sample_backlog(redis, clients, stats))
+            await asyncio.sleep(args.step_seconds)
+            steps.append(dict(stats[0].report(args.step_seconds, args.slo),
+                              unfinished=len(pending)))
+            pending.clear()
+            print(json.dumps(steps[-1]), flush=True)
+            target += args.step
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+        for client in clients:
+            await client.stop()
+        await close_redis()
+
+    saturated = next((s['clients'] for s in steps if s['saturated']), None)
+    return {'steps': steps, 'saturation_clients': saturated,
+            'utterances_per_minute': args.utterances_per_minute,
+            'mix': shares}
+
+
+def main():
+    args = parse_args()
+    # One blocking XREAD per listening client, plus uploads and sampling
+    os.environ.setdefault('REDIS_MAX_CONNECTIONS', str(args.max_clients + 16))
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main()
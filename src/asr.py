@@ -0,0 +1,369 @@
+"""
+Multi-process ASR worker pool. Every worker process owns its own
+`WhisperModel`, so utterances from different clients are transcribed in
+parallel instead of queueing behind a single model. Utterances arriving
+within a short window are micro-batched into one encoder/decoder pass.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import wire
+from .audio import SAMPLE_RATE
+from .batching import MicroBatcher
+from .config import (ASR_BATCH_WINDOW_MS, ASR_CPU_THREADS, ASR_DEVICE,
+                     ASR_MAX_BATCH, ASR_WORKERS, MODEL_SIZE, STARTUP_WARMUP)
+
+LANGUAGE_THRESHOLD = 0.8
+NO_SPEECH_THRESHOLD = 0.8
+LOG_PROB_THRESHOLD = -1.0
+MAX_LENGTH = 448
+MAX_BEAM_SIZE = 10
+# Silero speech threshold per client VAD mode: the more aggressive the
+# client's webrtcvad, the more the server filters as well
+VAD_THRESHOLDS = (0.35, 0.5, 0.6, 0.7)
+
+
+def _int_field(profile: typing.Dict[str, str], key: str,
+               low: int, high: int) -> typing.Optional[int]:
+    """ Integer profile field clamped to [low, high], None when missing or
+    malformed.
+    """
+    try:
+        return min(max(int(profile.get(key) or ''), low), high)
+    except ValueError:
+        return None
+
+
+class DecodeOptions(typing.NamedTuple):
+    """ Decoding settings of one session. A known language skips language
+    detection and its probability threshold; a VAD mode cuts non-speech
+    out before decoding, with the threshold of `VAD_THRESHOLDS`.
+    """
+    language: typing.Optional[str] = None
+    prompt: typing.Optional[str] = None
+    beam_size: int = 5
+    vad_mode: typing.Optional[int] = None
+
+    @classmethod
+    def from_profile(cls, profile: typing.Dict[str, str]) -> 'DecodeOptions':
+        """ Settings from the session profile fields of a client hash.
+        Malformed numbers fall back to the defaults rather than failing
+        every decode of the session.
+        """
+        beam_size = _int_field(profile, 'beam_size', 1, MAX_BEAM_SIZE)
+        return cls(language=profile.get('lang') or None,
+                   prompt=profile.get('prompt') or None,
+                   beam_size=beam_size or cls._field_defaults['beam_size'],
+                   vad_mode=_int_field(profile, 'vad_mode',
+                                       0, len(VAD_THRESHOLDS) - 1))
+
+    @property
+    def vad_parameters(self) -> typing.Optional[dict]:
+        """ faster-whisper VAD options, None without a VAD mode. """
+        if self.vad_mode is None:
+            return None
+        return {'threshold': VAD_THRESHOLDS[self.vad_mode]}
+
+
+DEFAULT_OPTIONS = DecodeOptions()
+
+# Set inside each worker process by `_init_worker`
+_model = None
+
+
+def _cuda_device_count() -> int:
+    try:
+        import ctranslate2
+        return ctranslate2.get_cuda_device_count()
+    except Exception:
+        return 0
+
+
+def _init_worker(model_size: str, device: str, device_queue,
+                 cpu_threads: int, warmup: bool = False) -> None:
+    global _model
+    from faster_whisper import WhisperModel
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("faster_whisper").setLevel(logging.ERROR)
+    device_index = device_queue.get()
+    _model = WhisperModel(model_size,
+                          device=device,
+                          device_index=device_index,
+                          compute_type="default",
+                          cpu_threads=cpu_threads)
+    logging.info(f'ASR worker {os.getpid()} loaded {model_size} '
+                 f'on {device}:{device_index}')
+    if warmup:
+        # The first decode initialises CUDA kernels and allocator pools
+        segments, _ = _model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32),
+                                        language='en', beam_size=1)
+        list(segments)
+
+
+def _join_segments(texts: typing.Iterable[str]) -> str:
+    text = ''
+    for t in texts:
+        if t.strip().replace('.', ''):
+            text += ', ' + t if text else t
+    return text
+
+
+def _transcribe_array(audio: np.ndarray,
+                      options: DecodeOptions = DEFAULT_OPTIONS) -> str:
+    segments, info = _model.transcribe(audio,
+                                       language=options.language,
+                                       initial_prompt=options.prompt,
+                                       beam_size=options.beam_size,
+                                       vad_filter=options.vad_mode is not None,
+                                       vad_parameters=options.vad_parameters,
+                                       no_speech_threshold=NO_SPEECH_THRESHOLD,
+                                       repetition_penalty=2
+                                       )
+    if options.language is None and info.language_probability < LANGUAGE_THRESHOLD:
+        return ''
+    return _join_segments(segment.text for segment in segments)
+
+
+def b_transcribe(audio_content: bytes,
+                 options: DecodeOptions = DEFAULT_OPTIONS) -> typing.Tuple[str, float]:
+    start_time = time.time()
+    _, audio = wire.decode(audio_content, SAMPLE_RATE)
+    text = _transcribe_array(audio, options)
+    return text, time.time() - start_time
+
+
+def b_transcribe_words(audio: np.ndarray, prompt: typing.Optional[str] = None,
+                       options: DecodeOptions = DEFAULT_OPTIONS
+                       ) -> typing.List[typing.Tuple[float, float, str]]:
+    """ Word-timestamped decode of a streaming session's rolling buffer,
+    prompted with its committed text or else the session prompt.
+    """
+    segments, _ = _model.transcribe(audio,
+                                    language=options.language,
+                                    beam_size=options.beam_size,
+                                    initial_prompt=prompt or options.prompt,
+                                    word_timestamps=True,
+                                    vad_filter=options.vad_mode is not None,
+                                    vad_parameters=options.vad_parameters,
+                                    condition_on_previous_text=False,
+                                    no_speech_threshold=NO_SPEECH_THRESHOLD,
+                                    repetition_penalty=2
+                                    )
+    return [(w.start, w.end, w.word) for s in segments for w in (s.words or [])]
+
+
+def _speech_only(audio: np.ndarray, options: DecodeOptions) -> np.ndarray:
+    """ The speech of `audio` as `vad_filter` keeps it, for the batched path
+    that calls the model directly.
+    """
+    if options.vad_mode is None:
+        return audio
+    from faster_whisper.vad import (VadOptions, collect_chunks,
+                                    get_speech_timestamps)
+    chunks = get_speech_timestamps(audio, VadOptions(**options.vad_parameters))
+    return collect_chunks(audio, chunks) if chunks else audio[:0]
+
+
+def _prompt_tokens(tokenizer, prompt: typing.Optional[str]) -> typing.List[int]:
+    """ Decoder prompt as WhisperModel builds it for an initial prompt. """
+    tokens = []
+    if prompt:
+        tokens = [tokenizer.sot_prev] + \
+            tokenizer.encode(' ' + prompt.strip())[-(MAX_LENGTH // 2 - 1):]
+    return tokens + list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+
+
+def b_transcribe_batch(
+        audio_contents: typing.List[bytes],
+        options: typing.Optional[typing.List[DecodeOptions]] = None
+) -> typing.List[typing.Tuple[str, float]]:
+    """ Transcribe several utterances with one batched encoder and decoder
+    call. Utterances longer than one 30 s Whisper window fall back to the
+    sequential `b_transcribe` path. All `options` share one prompt and beam
+    size; languages may differ, and the detection pass only runs when some
+    utterance has none.
+    """
+    import ctranslate2
+    from faster_whisper.audio import pad_or_trim
+    from faster_whisper.tokenizer import Tokenizer
+
+    start_time = time.time()
+    extractor = _model.feature_extractor
+    options = options or [DEFAULT_OPTIONS] * len(audio_contents)
+    audios = [_speech_only(wire.decode(a, extractor.sampling_rate)[1], o)
+              for a, o in zip(audio_contents, options)]
+    texts: typing.List[str] = [''] * len(audios)
+    batch = []
+    for i, audio in enumerate(audios):
+        if not audio.shape[0]:
+            continue  # nothing but silence
+        if audio.shape[0] > extractor.n_samples:
+            # Already cut down to speech
+            texts[i] = _transcribe_array(audio, options[i]._replace(vad_mode=None))
+        else:
+            batch.append(i)
+
+    if batch:
+        features = np.stack([pad_or_trim(extractor(audios[i])) for i in batch])
+        encoder_output = _model.model.encode(
+            ctranslate2.StorageView.from_array(np.ascontiguousarray(features)))
+
+        # A known language counts as certain
+        languages = [(f'<|{options[i].language}|>', 1.0) if options[i].language
+                     else None for i in batch]
+        if not _model.model.is_multilingual:
+            languages = [('<|en|>', 1.0)] * len(batch)
+        elif None in languages:
+            detected = _model.model.detect_language(encoder_output)
+            languages = [lang or r[0] for lang, r in zip(languages, detected)]
+        tokenizers = [Tokenizer(_model.hf_tokenizer,
+                                _model.model.is_multilingual,
+                                task="transcribe",
+                                language=token[2:-2]) for token, _ in languages]
+        prompts = [_prompt_tokens(t, options[i].prompt)
+                   for i, t in zip(batch, tokenizers)]
+        results = _model.model.generate(encoder_output,
+                                        prompts,
+                                        beam_size=options[batch[0]].beam_size,
+                                        repetition_penalty=2,
+                                        max_length=MAX_LENGTH,
+                                        return_scores=True,
+                                        return_no_speech_prob=True,
+                                        suppress_blank=True,
+                                        suppress_tokens=[-1])
+
+        for i, (_, prob), tokenizer, result in zip(batch, languages,
+                                                    tokenizers, results):
+            if prob < LANGUAGE_THRESHOLD:
+                continue
+            tokens = [t for t in result.sequences_ids[0] if t < tokenizer.eot]
+            avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+            # Same silence rule as WhisperModel.transcribe
+            if (result.no_speech_prob > NO_SPEECH_THRESHOLD
+                    and avg_logprob < LOG_PROB_THRESHOLD):
+                continue
+            texts[i] = _join_segments([tokenizer.decode(tokens)])
+
+    period = time.time() - start_time
+    return [(text, period) for text in texts]
+
+
+class ASRPool:
+    """ Pool of ASR worker processes.
+
+    Args:
+        model_size (str, optional): faster-whisper model name or path.
+        workers (int, optional): number of worker processes. 0 starts one
+            worker per CUDA device, or one per `cpu_threads` cores on CPU.
+        device (str, optional): "auto", "cuda" or "cpu".
+        cpu_threads (int, optional): intra-op threads per CPU worker.
+        batch_window_ms (float, optional): how long the first utterance of
+            a batch waits for others to join it.
+        max_batch (int, optional): largest batch sent to one worker, 1
+            disables batching.
+        warmup (bool, optional): decode a second of silence in every worker
+            after loading the model.
+    """
+
+    def __init__(self,
+                 model_size: str = MODEL_SIZE,
+                 workers: int = ASR_WORKERS,
+                 device: str = ASR_DEVICE,
+                 cpu_threads: int = ASR_CPU_THREADS,
+                 batch_window_ms: float = ASR_BATCH_WINDOW_MS,
+                 max_batch: int = ASR_MAX_BATCH,
+                 warmup: bool = 'asr' in STARTUP_WARMUP) -> None:
+        n_gpus = _cuda_device_count() if device in ("auto", "cuda") else 0
+        if n_gpus:
+            device = "cuda"
+            workers = workers or n_gpus
+        else:
+            device = "cpu"
+            workers = workers or max(1, (os.cpu_count() or 1) // cpu_threads)
+        self.workers = workers
+        self.device = device
+        self._batcher = MicroBatcher('asr', self._run_batch,
+                                     batch_window_ms, max_batch, workers)
+
+        # spawn: forking a process that already initialised CUDA is unsafe
+        ctx = multiprocessing.get_context("spawn")
+        device_queue = ctx.Queue()
+        for i in range(workers):
+            device_queue.put(i % n_gpus if n_gpus else 0)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(model_size, device, device_queue, cpu_threads, warmup))
+        logging.info(f'ASR pool: {workers} workers on {device}')
+
+    async def start(self) -> None:
+        """ Spawn every worker and wait until each has loaded its model.
+        Workers are otherwise spawned by the first utterances, which would
+        then wait for the model load.
+        """
+        loop = asyncio.get_running_loop()
+        ready: typing.Set[int] = set()
+        while len(ready) < self.workers:
+            # A worker only answers once its initializer is done; one that
+            # is ready may answer for those still loading, so ask again
+            pids = await asyncio.gather(*(
+                loop.run_in_executor(self._executor, os.getpid)
+                for _ in range(self.workers - len(ready))))
+            if ready.issuperset(pids):
+                await asyncio.sleep(0.1)
+            ready.update(pids)
+        logging.info(f'ASR workers ready: {sorted(ready)}')
+
+    async def transcribe(self, audio_content: bytes,
+                         options: DecodeOptions = DEFAULT_OPTIONS
+                         ) -> typing.Tuple[str, float]:
+        return await self._batcher.submit((audio_content, options))
+
+    async def transcribe_words(self, audio: np.ndarray,
+                               prompt: typing.Optional[str] = None,
+                               options: DecodeOptions = DEFAULT_OPTIONS) -> list:
+        """ Re-decode of a streaming buffer. Not batched: buffers differ in
+        length and each session needs word timestamps.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, b_transcribe_words,
+                                          audio, prompt, options)
+
+    async def _run_batch(self, items: typing.List[tuple]) -> list:
+        # One decoder call takes a single prompt and beam size, so the batch
+        # is split into groups that share them
+        loop = asyncio.get_running_loop()
+        groups: typing.Dict[tuple, typing.List[int]] = {}
+        for i, (_, options) in enumerate(items):
+            groups.setdefault((options.prompt, options.beam_size), []).append(i)
+
+        def run(indices):
+            if len(indices) == 1:
+                audio, options = items[indices[0]]
+                return loop.run_in_executor(self._executor, b_transcribe,
+                                            audio, options)
+            return loop.run_in_executor(self._executor, b_transcribe_batch,
+                                        [items[i][0] for i in indices],
+                                        [items[i][1] for i in indices])
+
+        results: list = [None] * len(items)
+        outputs = await asyncio.gather(*(run(g) for g in groups.values()))
+        for indices, output in zip(groups.values(), outputs):
+            if len(indices) == 1:
+                output = [output]
+            for i, result in zip(indices, output):
+                results[i] = result
+        return results
+
+    def shutdown(self) -> None:
+        self._batcher.close()
+        self._executor.shutdown(wait=False)
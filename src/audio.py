@@ -0,0 +1,72 @@
+"""
+In-memory audio conversions for the server hot path. Utterances never touch
+the disk or an audio decoder: 16-bit PCM WAV blobs from Redis are viewed
+with `np.frombuffer` and handed to the model as float32, and synthesized
+speech is serialized straight into a WAV byte string.
+"""
+import struct
+from io import BytesIO
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+TTS_SAMPLE_RATE = 24000
+
+
+def _pcm_data(blob: bytes):
+    """ Locate the sample data of a 16-bit PCM WAV blob.
+
+    Returns (offset, length, sample_rate, channels), or None when the blob
+    is not plain 16-bit PCM WAV.
+    """
+    if blob[:4] != b'RIFF' or blob[8:12] != b'WAVE':
+        return None
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(blob):
+        chunk_id, size = struct.unpack_from('<4sI', blob, pos)
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack_from('<HHIIHH', blob, body)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            audio_format, channels, sample_rate, _, _, bits = fmt
+            if audio_format != 1 or bits != 16:
+                return None
+            return body, min(size, len(blob) - body), sample_rate, channels
+        pos = body + size + (size & 1)
+    return None
+
+
+def decode_pcm(blob: bytes, sampling_rate: int = SAMPLE_RATE,
+               headerless: bool = False) -> np.ndarray:
+    """ Convert a 16-bit PCM WAV blob to a float32 array in [-1, 1].
+    With `headerless` the blob is raw 16-bit mono PCM at `sampling_rate`
+    instead. Anything else, e.g. Ogg, FLAC or MP3, goes through the PyAV
+    decoder.
+    """
+    if headerless:
+        info = 0, len(blob), sampling_rate, 1
+    else:
+        info = _pcm_data(blob)
+    if info is None or info[2] != sampling_rate:
+        from faster_whisper.audio import decode_audio
+        return decode_audio(BytesIO(blob), sampling_rate=sampling_rate)
+
+    offset, length, _, channels = info
+    samples = np.frombuffer(blob, dtype='<i2', count=length // 2, offset=offset)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples.astype(np.float32) / 32768.0
+
+
+def encode_wav(wav: np.ndarray, sample_rate: int = TTS_SAMPLE_RATE) -> bytes:
+    """ Serialize float audio in [-1, 1] to a mono 16-bit PCM WAV blob. """
+    pcm = (np.clip(np.asarray(wav, dtype=np.float32).reshape(-1), -1.0, 1.0)
+           * 32767).astype('<i2').tobytes()
+    header = struct.pack('<4sI4s4sIHHIIHH4sI',
+                         b'RIFF', 36 + len(pcm), b'WAVE',
+                         b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+                         b'data', len(pcm))
+    return header + pcm
@@ -0,0 +1,95 @@
+import asyncio
+import time
+import typing
+
+from . import metrics
+
+
+class MicroBatcher:
+    """ Collect concurrent requests into batches for a model call.
+
+    The first request of a batch waits up to `window_ms` for others to join,
+    up to `max_batch`. At most `concurrency` batches run at once; while they
+    do, new requests keep queueing, so batches grow with load. Batch sizes
+    and queue waits are recorded as `<name>.batch_size` and
+    `<name>.queue_wait`.
+
+    Args:
+        name (str): metrics prefix.
+        run_batch (callable): coroutine function mapping a list of items to
+            a list of results in the same order.
+        window_ms (float): batching window.
+        max_batch (int): largest batch, 1 disables batching.
+        concurrency (int): batches in flight.
+    """
+
+    def __init__(self,
+                 name: str,
+                 run_batch: typing.Callable[[list], typing.Awaitable[list]],
+                 window_ms: float,
+                 max_batch: int,
+                 concurrency: int) -> None:
+        self.name = name
+        self.run_batch = run_batch
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.concurrency = concurrency
+        self._pending: typing.Optional[asyncio.Queue] = None
+        self._slots: typing.Optional[asyncio.Semaphore] = None
+        self._batcher: typing.Optional[asyncio.Task] = None
+        self._inflight: typing.Set[asyncio.Task] = set()
+
+    async def submit(self, item: typing.Any) -> typing.Any:
+        if self._batcher is None:
+            self._pending = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._batcher = asyncio.create_task(self._batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.put_nowait((time.time(), item, future))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._pending.get()]
+        deadline = time.time() + self.window
+        while len(batch) < self.max_batch:
+            if not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+                continue
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batch_loop(self) -> None:
+        while True:
+            await self._slots.acquire()
+            batch = await self._collect()
+            now = time.time()
+            metrics.histogram(f'{self.name}.batch_size').observe(len(batch))
+            for enqueued, _, _ in batch:
+                metrics.histogram(f'{self.name}.queue_wait').observe(now - enqueued)
+            task = asyncio.create_task(self._run(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, batch: list) -> None:
+        try:
+            results = await self.run_batch([item for _, item, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def close(self) -> None:
+        if self._batcher is not None:
+            self._batcher.cancel()
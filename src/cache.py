@@ -0,0 +1,157 @@
+"""
+Cache tiers shared by the translation and TTS caches: an in-process LRU
+bounded by item count and/or byte size, an on-disk LRU bounded by byte
+size, and a Redis tier with TTL and a size limit that can be shared
+between server instances.
+"""
+import collections
+import os
+import tempfile
+import time
+import typing
+
+
+class LRUCache:
+    """ In-process LRU.
+
+    Args:
+        max_items (int, optional): entry limit, None for no limit.
+        max_bytes (int, optional): limit on the summed `sizeof` of values,
+            None for no limit.
+        sizeof (callable, optional): size of a value in bytes.
+    """
+
+    def __init__(self,
+                 max_items: typing.Optional[int] = None,
+                 max_bytes: typing.Optional[int] = None,
+                 sizeof: typing.Callable[[typing.Any], int] = len) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._data: collections.OrderedDict = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> typing.Any:
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key][0]
+
+    def set(self, key: str, value: typing.Any) -> None:
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        if key in self._data:
+            self.bytes -= self._data.pop(key)[1]
+        self._data[key] = (value, size)
+        self.bytes += size
+        while ((self.max_items is not None and len(self._data) > self.max_items)
+               or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.bytes -= evicted
+
+
+class RedisCache:
+    """ Shared Redis tier. Every entry is a plain key with a TTL; a sorted
+    set of last-write times tracks the keys so that the tier can be kept
+    under `max_items` by evicting the oldest.
+
+    Args:
+        redis: asyncio redis client.
+        prefix (str): key namespace, e.g. "STS:CACHE:TRANSLATE".
+        ttl (int): seconds an entry lives.
+        max_items (int): entry limit.
+    """
+
+    def __init__(self, redis, prefix: str, ttl: int, max_items: int) -> None:
+        self.redis = redis
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_items = max_items
+        self.index = f'{prefix}:INDEX'
+
+    async def get(self, key: str) -> typing.Optional[bytes]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(f'{self.prefix}:{key}')
+            # Refresh the entry's position so eviction is least-recently-used
+            pipe.zadd(self.index, {key: time.time()}, xx=True)
+            value, _ = await pipe.execute()
+        return value
+
+    async def set(self, key: str, value: bytes) -> None:
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(f'{self.prefix}:{key}', value, ex=self.ttl)
+            pipe.zadd(self.index, {key: now})
+            pipe.zremrangebyscore(self.index, '-inf', now - self.ttl)
+            pipe.zcard(self.index)
+            *_, size = await pipe.execute()
+        if size > self.max_items:
+            evicted = await self.redis.zpopmin(self.index, size - self.max_items)
+            if evicted:
+                await self.redis.delete(
+                    *(f'{self.prefix}:{k.decode("utf-8")}' for k, _ in evicted))
+
+
+class DiskCache:
+    """ On-disk LRU of byte strings, one file per entry. File mtimes record
+    recency and the directory is kept under `max_bytes`. Methods block and
+    should be run on an executor.
+
+    Args:
+        directory (str): cache directory, created if missing.
+        max_bytes (int): byte budget for all entries.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.bytes = sum(e.stat().st_size for e in os.scandir(directory)
+                         if e.is_file())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            self.bytes -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp, path)
+        self.bytes += len(value)
+        if self.bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = sorted((e for e in os.scandir(self.directory)
+                          if e.is_file() and not e.name.endswith('.tmp')),
+                         key=lambda e: e.stat().st_mtime)
+        for entry in entries:
+            if self.bytes <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+            self.bytes -= size
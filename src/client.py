@@ -0,0 +1,291 @@
+"""
+Microphone client shared by client_en and client_zh, which only pick the
+language the speaker talks and listens in and the VAD sensitivity.
+
+One process records utterances (or streaming chunks) and uploads them for
+the server's ingest mode; another joins the room's stream of its language
+with a single blocking XREAD and plays every other speaker through one
+`Player`. Both run from `main(lang, vad_mode)`.
+"""
+import asyncio
+import atexit
+import json
+import logging
+import multiprocessing
+import time
+import uuid
+
+import numpy as np
+import pyaudio
+
+from . import codec, metrics, protocol, tracing, wire
+from .audio import TTS_SAMPLE_RATE
+from .config import (ASR_BEAM_SIZE, ASR_PROMPT, AUDIO_CODECS,
+                     AUDIO_QUEUE_MAXLEN, CLIENT_STREAMING, INGEST_MODE,
+                     METRICS_INTERVAL, PLAYBACK_DEADLINE_S, QUEUE_TTL, ROOM,
+                     STREAM_CHUNK_MS)
+from .executors import run_in
+from .playback import Player
+from .redis_pool import get_redis
+from .vad import VadSegmenter, stream_frames
+
+# Audio recording parameters
+FORMAT = pyaudio.paInt16
+CHANNELS = 1
+RATE = 16000
+CHUNK = 2048
+FRAME_DURATION = 30  # milliseconds
+FRAME_SIZE = int(RATE * FRAME_DURATION / 1000)
+
+# Encoded chunks handed from the recorder thread to the uploader, FIFO.
+# Created on the input process's event loop by `input_audio`.
+g_uploads: asyncio.Queue = None
+g_loop: asyncio.AbstractEventLoop = None
+# Output stream of the output process, opened by `output_audio`
+player: Player = None
+# Microphone and VAD of the input process, opened by `input_audio`
+audio: pyaudio.PyAudio = None
+stream = None
+segmenter: VadSegmenter = None
+# Uplink codec, negotiated against the server at registration
+g_codec = codec.PCM
+# Chunk sequence number of the uplink stream
+g_seq = 0
+logging.basicConfig(level=logging.INFO)
+
+
+async def sync_audio(client_uuid):
+    # Sync audio to the redis list STS:AUDIOS, or stream STS:AUDIOSTREAM in
+    # stream ingest mode. Sleeps until the recorder hands over a chunk;
+    # whatever queued up meanwhile goes out in the same round trip, oldest
+    # first.
+    redis = get_redis()
+    while True:
+        batch = [await g_uploads.get()]
+        while not g_uploads.empty():
+            batch.append(g_uploads.get_nowait())
+        batch = [wire.restamp(blob, 'enqueue') for blob in batch]
+        async with redis.pipeline(transaction=False) as pipe:
+            protocol.push_audio(pipe, client_uuid, batch, INGEST_MODE,
+                                AUDIO_QUEUE_MAXLEN, QUEUE_TTL)
+            length = (await pipe.execute())[0]
+        # A stream also keeps entries already processed until trimmed, so
+        # its trimming is not counted as shed
+        shed = 0 if INGEST_MODE == 'stream' else \
+            protocol.overflow(length, AUDIO_QUEUE_MAXLEN)
+        if shed:
+            metrics.incr('shed.audio.queue', shed)
+            logging.warning(f'Server behind, dropped {shed} oldest audio chunk(s)')
+        logging.info(f'step4 Sync {len(batch)} audio chunk(s) to redis server')
+
+
+def record_until_silence():
+    for frame in stream_frames(stream, FRAME_SIZE):
+        was_triggered = segmenter.triggered
+        pcm = segmenter.push(frame)
+        if segmenter.triggered and not was_triggered:
+            logging.info("step2 Start recording...")
+        if pcm is not None:
+            logging.info("step3 Stop recording...")
+            push_chunk([pcm], True, False)
+            break
+
+
+def push_chunk(frames, last, stream_flag):
+    global g_seq
+    trace = tracing.new_trace(capture=time.time())
+    samples = np.frombuffer(b''.join(frames), dtype='<i2')
+    payload = codec.encode(samples, RATE, g_codec) if len(samples) else b''
+    blob = wire.pack(payload, seq=g_seq, last=last,
+                     codec=g_codec if len(samples) else codec.PCM,
+                     sample_rate=RATE, stream=stream_flag, trace=trace)
+    # Called on the recorder thread, wake the uploader on the event loop
+    g_loop.call_soon_threadsafe(g_uploads.put_nowait, blob)
+    g_seq += 1
+
+
+def stream_until_silence():
+    # Streaming mode: send a STREAM_CHUNK_MS chunk as soon as it is recorded
+    # while speech is active, then an empty last chunk once the speaker has
+    # been silent for a couple of chunks
+    frames_per_chunk = max(1, STREAM_CHUNK_MS // FRAME_DURATION)
+    hangover = 2
+    triggered = False
+    silent = 0
+    while True:
+        frames = [stream.read(FRAME_SIZE) for _ in range(frames_per_chunk)]
+        num_voiced = sum(segmenter.is_speech(frame) for frame in frames)
+        if num_voiced > 0.3 * frames_per_chunk:
+            if not triggered:
+                logging.info("step2 Start streaming... ")
+            triggered = True
+            silent = 0
+        elif triggered:
+            silent += 1
+        if not triggered:
+            continue
+        push_chunk(frames, False, True)
+        if silent >= hangover:
+            logging.info("step3 Stop streaming...")
+            push_chunk([], True, True)
+            break
+
+
+async def record_audio():
+    recorder = stream_until_silence if CLIENT_STREAMING else record_until_silence
+    while True:
+        await run_in('io', recorder)
+
+
+async def receive_audio(lang, client_uuid):
+    # Every speaker of the room is published once to the room's stream of
+    # our language; a single blocking XREAD at our own offset receives them
+    # all, whoever else is listening. Start at the newest entry.
+    redis = get_redis()
+    key = protocol.room_key(ROOM, lang)
+    last_id = '$'
+    logging.info(f"step5 Subscribe to sts {key}")
+    while True:
+        replies = await redis.xread({key: last_id}, count=100, block=0)
+        for _, entries in replies:
+            for entry_id, fields in entries:
+                last_id = entry_id
+                speaker = fields[b'speaker'].decode('utf-8')
+                if speaker == client_uuid:
+                    continue
+                frame = wire.unpack(fields[b'audio'])
+                logging.info(f"step6 Received chunk {frame.seq} from {lang} {speaker}")
+                if PLAYBACK_DEADLINE_S and frame.ts \
+                        and time.time() - frame.ts > PLAYBACK_DEADLINE_S:
+                    metrics.incr('shed.playback.deadline')
+                    continue
+                frame, samples = wire.decode(fields[b'audio'], TTS_SAMPLE_RATE)
+                # Chunks of one utterance arrive sentence by sentence, the
+                # player queues them in order behind what is already playing
+                player.put(speaker, frame.seq, samples,
+                           frame.sample_rate or TTS_SAMPLE_RATE, frame.ts,
+                           frame.trace)
+
+
+async def report_traces(interval=1.0):
+    # Send play-start stamps of traced chunks back to the server
+    redis = get_redis()
+    while True:
+        await asyncio.sleep(interval)
+        traces = player.take_played()
+        if not traces:
+            continue
+        async with redis.pipeline(transaction=False) as pipe:
+            protocol.push_bounded(pipe, protocol.TRACES_KEY,
+                                  [json.dumps(t) for t in traces],
+                                  protocol.TRACES_MAXLEN)
+            await pipe.execute()
+
+
+async def report_metrics(interval=METRICS_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        metrics.log_snapshot()
+
+
+async def register_client(client_uuid, lang, vad_mode):
+    global g_codec
+    redis = get_redis()
+    # Register client UUID with its session profile
+    await protocol.register_client(redis, client_uuid,
+                                   {'codecs': ','.join(codec.available()),
+                                    'room': ROOM, 'lang': lang,
+                                    'prompt': ASR_PROMPT,
+                                    'beam_size': str(ASR_BEAM_SIZE),
+                                    'vad_mode': str(vad_mode)})
+    server_codecs = await redis.smembers(protocol.SERVER_CODECS_KEY)
+    if server_codecs:
+        name = codec.negotiate(AUDIO_CODECS,
+                               [[c.decode('utf-8') for c in server_codecs]])
+        g_codec = codec.CODECS[name]
+    logging.info(f"uplink codec: {codec.NAMES[g_codec]}")
+    logging.info(f"step1 register Client UUID: {client_uuid}")
+
+
+async def deregister_client(client_uuid):
+    redis = get_redis()
+    await protocol.deregister_client(redis, client_uuid)
+    logging.info(f"deregister Client UUID: {client_uuid}")
+
+
+def exit_handler(client_uuid):
+    asyncio.run(deregister_client(client_uuid))
+
+
+async def input_audio(client_uuid, lang, vad_mode):
+    global g_uploads, g_loop, audio, stream, segmenter
+    g_loop = asyncio.get_running_loop()
+    g_uploads = asyncio.Queue()
+    segmenter = VadSegmenter(mode=vad_mode, sample_rate=RATE,
+                             frame_duration=FRAME_DURATION)
+    # For audio recording
+    audio = pyaudio.PyAudio()
+    stream = audio.open(format=FORMAT,
+                        channels=CHANNELS,
+                        rate=RATE,
+                        input=True,
+                        frames_per_buffer=CHUNK)
+    try:
+        task0 = asyncio.create_task(register_client(client_uuid, lang, vad_mode))
+        task1 = asyncio.create_task(record_audio())
+        task2 = asyncio.create_task(sync_audio(client_uuid))
+        task5 = asyncio.create_task(report_metrics())
+        await asyncio.gather(task0, task1, task2, task5)
+    except KeyboardInterrupt:
+        # Deregister client UUID
+        await deregister_client(client_uuid)
+    finally:
+        stream.stop_stream()
+        stream.close()
+        audio.terminate()
+
+
+async def output_audio(client_uuid, lang):
+    global player
+    player = Player().start()
+    try:
+        task3 = asyncio.create_task(receive_audio(lang, client_uuid))
+        task4 = asyncio.create_task(report_metrics())
+        task6 = asyncio.create_task(report_traces())
+        await asyncio.gather(task3, task4, task6)
+    except KeyboardInterrupt:
+        # Deregister client UUID
+        await deregister_client(client_uuid)
+    finally:
+        player.close()
+
+
+def run_coroutine(coro_func, *args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        coro = coro_func(*args)
+        loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def main(lang, vad_mode):
+    """ Run a client speaking and listening in `lang` until interrupted.
+
+    Args:
+        lang (str): language code of the speaker and of the room stream it
+            listens to.
+        vad_mode (int): VAD sensitivity from 0 to 3, 0 is least sensitive.
+    """
+    # Generate a unique UUID for the client
+    c_uuid = str(uuid.uuid4())
+    atexit.register(exit_handler, c_uuid)
+    p1 = multiprocessing.Process(target=run_coroutine,
+                                 args=(input_audio, c_uuid, lang, vad_mode))
+    p2 = multiprocessing.Process(target=run_coroutine,
+                                 args=(output_audio, c_uuid, lang))
+    p1.start()
+    p2.start()
+    p1.join()
+    p2.join()
@@ -0,0 +1,88 @@
+"""
+Audio codecs for the Redis transport. Every party advertises the codecs it
+can handle and the sender picks the first of its preferences that all
+receivers support, falling back to raw PCM, which everyone can decode.
+
+    wav:  legacy 16-bit PCM WAV container
+    pcm:  headerless 16-bit little-endian mono PCM
+    flac: lossless, roughly half the size of PCM for speech
+    opus: lossy (Ogg/Opus), an order of magnitude smaller than PCM
+
+FLAC and Opus go through libsndfile (the `soundfile` package); Opus needs
+libsndfile 1.0.29 or newer and is only advertised when available.
+"""
+import typing
+from io import BytesIO
+
+import numpy as np
+
+from .audio import decode_pcm, encode_wav
+
+WAV, PCM, FLAC, OPUS = 0, 1, 2, 3
+CODECS = {'wav': WAV, 'pcm': PCM, 'flac': FLAC, 'opus': OPUS}
+NAMES = {v: k for k, v in CODECS.items()}
+
+
+def available() -> typing.List[str]:
+    names = ['pcm', 'wav']
+    try:
+        import soundfile
+    except ImportError:
+        return names
+    if 'FLAC' in soundfile.available_formats():
+        names.insert(0, 'flac')
+    if 'OPUS' in soundfile.available_subtypes('OGG'):
+        names.insert(0, 'opus')
+    return names
+
+
+def negotiate(preferences: typing.Sequence[str],
+              supported: typing.Iterable[typing.Iterable[str]]) -> str:
+    """ First preferred codec supported by every receiver, else "pcm". """
+    common = set(available())
+    for codecs in supported:
+        common &= set(codecs)
+    for name in preferences:
+        if name in common:
+            return name
+    return 'pcm'
+
+
+def _to_int16(samples: np.ndarray) -> np.ndarray:
+    samples = np.asarray(samples).reshape(-1)
+    if samples.dtype == np.int16:
+        return samples
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+
+
+def encode(samples: np.ndarray, sample_rate: int, codec: int) -> bytes:
+    """ Encode mono float32 in [-1, 1] or int16 samples. """
+    pcm = _to_int16(samples)
+    if codec == PCM:
+        return pcm.astype('<i2').tobytes()
+    if codec == WAV:
+        return encode_wav(pcm.astype(np.float32) / 32768.0, sample_rate)
+
+    import soundfile
+    buf = BytesIO()
+    if codec == FLAC:
+        soundfile.write(buf, pcm, sample_rate, format='FLAC', subtype='PCM_16')
+    elif codec == OPUS:
+        soundfile.write(buf, pcm, sample_rate, format='OGG', subtype='OPUS')
+    else:
+        raise ValueError(f'Unknown codec {codec}')
+    return buf.getvalue()
+
+
+def decode(payload: bytes, codec: int, sample_rate: int) -> np.ndarray:
+    """ Decode to mono float32 in [-1, 1] at the encoded sample rate. """
+    if codec == PCM:
+        return decode_pcm(payload, sample_rate, headerless=True)
+    if codec == WAV:
+        return decode_pcm(payload, sample_rate)
+    if codec in (FLAC, OPUS):
+        import soundfile
+        samples, _ = soundfile.read(BytesIO(payload), dtype='float32')
+        return samples.reshape(len(samples), -1).mean(axis=1) \
+            if samples.ndim > 1 else samples
+    raise ValueError(f'Unknown codec {codec}')
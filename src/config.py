@@ -9,3 +9,110 @@ if REDIS_SERVER is None:
     raise EnvironmentError(
         "The REDIS_SERVER environment variable is not set. "
         "Please set it in your .env file or as an environment variable.")
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '20'))
+# Seconds to wait for a free pooled connection before raising
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', '20'))
+
+# Uplink ingest: "list" for a single server popping STS:AUDIOS:{uuid}, or
+# "stream" for any number of servers sharing STS:AUDIOSTREAM:{uuid} through
+# a consumer group. List mode supports exactly one server: registration
+# events are popped from STS:EVENTS, so with several servers each one would
+# only see some of them, and a client's utterances would be split between
+# servers and come back out of order. In stream mode a client's stream is
+# leased to one server at a time for INGEST_LEASE_MS so that its utterances
+# stay in order; entries a dead server left unacknowledged are claimed by
+# the next leaseholder. INGEST_CONSUMER names this server in the group,
+# hostname-pid by default.
+INGEST_MODE = os.getenv('INGEST_MODE', 'list')
+INGEST_LEASE_MS = int(os.getenv('INGEST_LEASE_MS', '10000'))
+INGEST_CONSUMER = os.getenv('INGEST_CONSUMER', '')
+
+# Audio codec preference for Redis transport, negotiated against what the
+# other side supports; "pcm" is always the fallback. FLAC encodes several
+# times faster than Opus, which costs about 100 ms per 2 s of speech on the
+# latency path, so Opus only pays off on slow links.
+AUDIO_CODECS = os.getenv('AUDIO_CODECS', 'flac,opus,pcm').split(',')
+
+# ASR worker pool
+MODEL_SIZE = os.getenv('MODEL_SIZE', 'large-v3')
+ASR_DEVICE = os.getenv('ASR_DEVICE', 'auto')
+# 0 means one worker per GPU, or one worker per ASR_CPU_THREADS cores on CPU
+ASR_WORKERS = int(os.getenv('ASR_WORKERS', '0'))
+ASR_CPU_THREADS = int(os.getenv('ASR_CPU_THREADS', '4'))
+# Micro-batching window in front of the ASR workers
+ASR_BATCH_WINDOW_MS = float(os.getenv('ASR_BATCH_WINDOW_MS', '50'))
+ASR_MAX_BATCH = int(os.getenv('ASR_MAX_BATCH', '8'))
+# Streaming mode: clients send fixed-size chunks while the speaker talks
+# and receive partial hypotheses instead of waiting for the utterance end
+CLIENT_STREAMING = os.getenv('CLIENT_STREAMING', '0') == '1'
+STREAM_CHUNK_MS = int(os.getenv('STREAM_CHUNK_MS', '500'))
+# Room a client joins: it hears the translated speech of every other
+# speaker in the room, published once per language
+ROOM = os.getenv('ROOM', 'default')
+# Session profile a client registers besides its language, which lets the
+# server skip language detection: an initial prompt and beam size for ASR
+ASR_PROMPT = os.getenv('ASR_PROMPT', '')
+ASR_BEAM_SIZE = int(os.getenv('ASR_BEAM_SIZE', '5'))
+# Client playback: each speaker's chunks wait PLAYBACK_JITTER_MS before the
+# first one plays, a missing chunk is skipped after PLAYBACK_MAX_GAP_MS, and
+# concurrent speakers are mixed (1) or played one after another (0)
+PLAYBACK_JITTER_MS = float(os.getenv('PLAYBACK_JITTER_MS', '60'))
+PLAYBACK_MAX_GAP_MS = float(os.getenv('PLAYBACK_MAX_GAP_MS', '500'))
+PLAYBACK_MIX = os.getenv('PLAYBACK_MIX', '1') == '1'
+# Admission control, 0 disables a limit. Uplink queues and room streams keep
+# only their newest *_QUEUE_MAXLEN entries and expire QUEUE_TTL seconds after
+# the last write. SERVER_QUEUE_MAXLEN bounds the work waiting per client inside
+# the server. Utterances older than AUDIO_DEADLINE_S are skipped before ASR
+# and TTS chunks older than PLAYBACK_DEADLINE_S are not played; both compare
+# against the sender's clock.
+AUDIO_QUEUE_MAXLEN = int(os.getenv('AUDIO_QUEUE_MAXLEN', '20'))
+TTS_QUEUE_MAXLEN = int(os.getenv('TTS_QUEUE_MAXLEN', '50'))
+SERVER_QUEUE_MAXLEN = int(os.getenv('SERVER_QUEUE_MAXLEN', '8'))
+QUEUE_TTL = int(os.getenv('QUEUE_TTL', '300'))
+AUDIO_DEADLINE_S = float(os.getenv('AUDIO_DEADLINE_S', '15'))
+PLAYBACK_DEADLINE_S = float(os.getenv('PLAYBACK_DEADLINE_S', '30'))
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', '60'))
+# Server HTTP metrics endpoint, port 0 disables it
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# Server startup: ASR workers and the TTS model load in parallel, then the
+# stages listed in STARTUP_WARMUP ("asr,tts", empty for none) run one dummy
+# request each. ChatTTS is compiled with torch.compile if TTS_COMPILE is
+# set, and the compiled kernels are kept in COMPILE_CACHE_DIR between
+# restarts.
+STARTUP_WARMUP = [s for s in os.getenv('STARTUP_WARMUP', 'asr,tts').split(',') if s]
+TTS_WARMUP_TEXT = os.getenv('TTS_WARMUP_TEXT', '初始化一下')
+TTS_COMPILE = os.getenv('TTS_COMPILE', '1') == '1'
+COMPILE_CACHE_DIR = os.getenv('COMPILE_CACHE_DIR', '.cache/compile')
+
+# Translation stage
+# "bedrock", or "stub" for a local echo backend without AWS credentials
+TRANSLATE_BACKEND = os.getenv('TRANSLATE_BACKEND', 'bedrock')
+TRANSLATE_MODEL_ID = os.getenv('TRANSLATE_MODEL_ID',
+                               'anthropic.claude-3-sonnet-20240229-v1:0')
+TRANSLATE_REGION = os.getenv('TRANSLATE_REGION', 'us-west-2')
+TRANSLATE_MAX_BATCH = int(os.getenv('TRANSLATE_MAX_BATCH', '8'))
+TRANSLATE_CONCURRENCY = int(os.getenv('TRANSLATE_CONCURRENCY', '4'))
+TRANSLATE_STUB_LATENCY = float(os.getenv('TRANSLATE_STUB_LATENCY', '0'))
+# Translation cache: in-process LRU plus an optional shared Redis tier
+TRANSLATE_CACHE_SIZE = int(os.getenv('TRANSLATE_CACHE_SIZE', '1024'))
+TRANSLATE_CACHE_REDIS = os.getenv('TRANSLATE_CACHE_REDIS', '0') == '1'
+TRANSLATE_CACHE_TTL = int(os.getenv('TRANSLATE_CACHE_TTL', '86400'))
+TRANSLATE_CACHE_REDIS_SIZE = int(os.getenv('TRANSLATE_CACHE_REDIS_SIZE', '10000'))
+
+# TTS backend: "chattts", or "stub" for silence after a fake latency
+TTS_BACKEND = os.getenv('TTS_BACKEND', 'chattts')
+TTS_STUB_LATENCY = float(os.getenv('TTS_STUB_LATENCY', '0'))
+# TTS batching window: texts across languages and utterances share a pass
+TTS_BATCH_WINDOW_MS = float(os.getenv('TTS_BATCH_WINDOW_MS', '20'))
+TTS_MAX_BATCH = int(os.getenv('TTS_MAX_BATCH', '8'))
+# Sentence-chunked streaming: synthesize and push a translation piece by piece
+TTS_STREAM = os.getenv('TTS_STREAM', '1') == '1'
+TTS_MIN_CHUNK_CHARS = int(os.getenv('TTS_MIN_CHUNK_CHARS', '10'))
+# TTS audio cache: in-process LRU plus an optional "disk" or "redis" tier
+TTS_CACHE_BYTES = int(os.getenv('TTS_CACHE_BYTES', str(64 * 1024 * 1024)))
+TTS_CACHE_TIER = os.getenv('TTS_CACHE_TIER', 'none')
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', '.cache/tts')
+TTS_CACHE_DISK_BYTES = int(os.getenv('TTS_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+TTS_CACHE_REDIS_SIZE = int(os.getenv('TTS_CACHE_REDIS_SIZE', '2000'))
+TTS_CACHE_TTL = int(os.getenv('TTS_CACHE_TTL', '86400'))
@@ -1,8 +1,6 @@
 #!/usr/bin/env python
-import asyncio
 import os
 import typing
-from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
 import av
@@ -13,6 +11,8 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
+from src.executors import run_in
+
 # Accept the following environment variables from Docker
 MODEL_SIZE = os.getenv('MODEL', 'base')
 PROMPT = os.getenv('PROMPT', '基于FastWhisper的低延迟语音转写服务')
@@ -37,12 +37,6 @@ app = FastAPI()
 app.add_middleware(ValidateFileTypeMiddleware)
 
 
-async def asyncformer(sync_func: typing.Callable, *args, **kwargs):
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as pool:
-        return await loop.run_in_executor(pool, sync_func, *args, **kwargs)
-
-
 class Transcriber:
     _instance = None
 
@@ -84,11 +78,13 @@ class Transcriber:
 
     async def __call__(self, audio: bytes) -> typing.AsyncGenerator[str, None]:
         def _process():
-            return self._model.transcribe(BytesIO(audio),
-                                          initial_prompt=self.prompt,
-                                          vad_filter=True)
+            segments, info = self._model.transcribe(BytesIO(audio),
+                                                    initial_prompt=self.prompt,
+                                                    vad_filter=True)
+            # segments is lazy, decode here rather than on the event loop
+            return list(segments), info
 
-        segments, info = await asyncformer(_process)
+        segments, info = await run_in('asr', _process)
         for segment in segments:
             t = segment.text
             if self.prompt in t.strip():
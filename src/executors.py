@@ -0,0 +1,119 @@
+"""
+Long-lived thread pools for blocking work, one per kind of work so that a
+slow model call cannot starve Redis or file I/O:
+
+    asr: speech recognition model calls
+    tts:   speech synthesis model calls
+    codec: audio encoding, kept off the model threads
+    io:    blocking I/O such as microphone reads and HTTP/SDK calls
+
+Each pool has a bounded queue. Once `workers + queue` calls are in flight,
+further callers wait asynchronously for a slot, which pushes backpressure
+up to whoever produces the work instead of queueing without limit.
+
+Sizes come straight from the environment (EXECUTOR_<NAME>_WORKERS and
+EXECUTOR_<NAME>_QUEUE) so this module does not depend on `config` and can
+be shipped on its own, e.g. in the whisper Docker image.
+"""
+import asyncio
+import os
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+
+DEFAULTS = {
+    'asr': (1, 16),
+    'tts': (1, 16),
+    'codec': (2, 64),
+    'io': (4, 64),
+}
+
+
+class BoundedExecutor:
+    """ Thread pool with a bounded queue and wait-time instrumentation.
+
+    Args:
+        name (str): pool name, used for thread names and metrics.
+        workers (int): number of threads.
+        queue_size (int): calls allowed to wait for a thread.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix=f'{name}-executor')
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._started = 0
+        self._finished = 0
+        self._slots: typing.Optional[asyncio.Semaphore] = None
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+            self._loop = loop
+        return self._slots
+
+    def stats(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._submitted - self._started,
+                'running': self._started - self._finished,
+            }
+
+    def _call(self, fn: typing.Callable, args, kwargs):
+        started = time.time()
+        with self._lock:
+            self._started += 1
+        try:
+            return started, fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._finished += 1
+
+    async def run(self, fn: typing.Callable, *args, **kwargs) -> typing.Any:
+        async with self._get_slots():
+            submitted = time.time()
+            with self._lock:
+                self._submitted += 1
+            loop = asyncio.get_running_loop()
+            started, result = await loop.run_in_executor(
+                self._pool, self._call, fn, args, kwargs)
+            metrics.histogram(f'executor.{self.name}.wait').observe(
+                started - submitted)
+            metrics.histogram(f'executor.{self.name}.run').observe(
+                time.time() - started)
+            return result
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+EXECUTORS: typing.Dict[str, BoundedExecutor] = {}
+
+
+def get_executor(name: str) -> BoundedExecutor:
+    if name not in EXECUTORS:
+        workers, queue_size = DEFAULTS[name]
+        prefix = f'EXECUTOR_{name.upper()}'
+        executor = BoundedExecutor(
+            name,
+            int(os.getenv(f'{prefix}_WORKERS', workers)),
+            int(os.getenv(f'{prefix}_QUEUE', queue_size)))
+        EXECUTORS[name] = executor
+        metrics.register_gauge(f'executor.{name}', executor.stats)
+    return EXECUTORS[name]
+
+
+async def run_in(name: str, sync_func: typing.Callable, *args,
+                 **kwargs) -> typing.Any:
+    """ Run a blocking callable on the named shared pool. """
+    return await get_executor(name).run(sync_func, *args, **kwargs)
@@ -0,0 +1,363 @@
+import asyncio
+import collections
+import functools
+import logging
+import os
+import socket
+import time
+import typing
+
+from redis.exceptions import RedisError, ResponseError
+
+from . import metrics, wire
+from .config import INGEST_CONSUMER, INGEST_LEASE_MS
+from .protocol import (AUDIO_GROUP, CLIENTS_KEY, EVENTS_CHANNEL, EVENTS_KEY,
+                       SERVERS_KEY, audio_key, audio_stream_key, decode_event,
+                       lease_key)
+
+# Renew or give back a lease only while this server still holds it
+RENEW_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class UplinkGaps:
+    """ Count the audio chunks a client pushed that never reached this
+    server, from gaps in their sequence numbers. Bounded queues drop the
+    oldest chunks on the client's side of Redis, so this is where the
+    server learns about them; they are counted as `shed.audio.queue`.
+    """
+
+    def __init__(self) -> None:
+        self._last: typing.Dict[str, int] = {}
+
+    def observe(self, client_uuid: str, blob: bytes) -> int:
+        seq = wire.peek_seq(blob)
+        if seq is None:
+            return 0
+        last = self._last.get(client_uuid)
+        self._last[client_uuid] = seq
+        lost = seq - last - 1 if last is not None and seq > last else 0
+        if lost:
+            metrics.incr('shed.audio.queue', lost)
+            logging.warning(f"Lost {lost} audio chunk(s) of {client_uuid}")
+        return lost
+
+    def forget(self, client_uuid: str) -> None:
+        """ Start over, e.g. when another server may have read in between. """
+        self._last.pop(client_uuid, None)
+
+
+class AudioIngest:
+    """ Wait on every client audio queue with a single blocking BLPOP.
+
+    The key set is loaded once from `client_uuids` and afterwards kept up to
+    date from the registration events list, which is itself part of the
+    BLPOP key set so that a new client wakes the blocking call immediately.
+    Pickup latency therefore does not depend on the number of clients.
+    Items are popped, so unlike `StreamIngest` there is nothing to
+    acknowledge and the third element of every item is None. Events and
+    audio are popped by whichever server gets them first, so only one
+    server may run this ingest at a time; several use `StreamIngest`.
+
+    Args:
+        redis: asyncio redis client.
+        registry (ClientRegistry, optional): kept in sync with the same
+            registration events.
+        timeout (int, optional): BLPOP timeout in seconds, 0 blocks forever.
+    """
+
+    def __init__(self, redis, registry=None, timeout: int = 0) -> None:
+        self.redis = redis
+        self.registry = registry
+        self.timeout = timeout
+        self.uuids: typing.List[str] = []
+        self.gaps = UplinkGaps()
+        self._next = 0
+
+    async def refresh(self) -> None:
+        uuids = await self.redis.smembers(CLIENTS_KEY)
+        self.uuids = sorted(u.decode('utf-8') for u in uuids)
+        logging.info(f"uuids: {self.uuids}")
+        if self.registry is not None:
+            await self.registry.load(self.uuids)
+
+    async def _handle_event(self, raw: bytes) -> None:
+        event, client_uuid = decode_event(raw)
+        if event == 'register' and client_uuid not in self.uuids:
+            self.uuids.append(client_uuid)
+        elif event == 'deregister' and client_uuid in self.uuids:
+            self.uuids.remove(client_uuid)
+            self.gaps.forget(client_uuid)
+        logging.info(f"{event} {client_uuid}, uuids: {self.uuids}")
+        if self.registry is not None:
+            await self.registry.handle(event, client_uuid)
+
+    def _keys(self) -> typing.List[str]:
+        # Rotate the start so that one busy client cannot starve the others,
+        # BLPOP always serves the first non-empty key.
+        n = len(self.uuids)
+        start = self._next % n if n else 0
+        ordered = self.uuids[start:] + self.uuids[:start]
+        return [EVENTS_KEY] + [audio_key(u) for u in ordered]
+
+    async def __aiter__(self) -> typing.AsyncIterator[typing.Tuple[str, bytes, None]]:
+        await self.refresh()
+        while True:
+            content = await self.redis.blpop(self._keys(), timeout=self.timeout)
+            if content is None:
+                continue
+            key, value = content
+            key = key.decode('utf-8')
+            if key == EVENTS_KEY:
+                await self._handle_event(value)
+                continue
+            client_uuid = key.rsplit(':', 1)[1]
+            if client_uuid in self.uuids:
+                self._next = self.uuids.index(client_uuid) + 1
+            self.gaps.observe(client_uuid, value)
+            yield client_uuid, value, None
+
+
+class StreamIngest:
+    """ Read client audio streams as one consumer of the servers' group.
+
+    Every client stream is leased to a single server at a time, so one
+    client's utterances are still processed in order while different
+    clients spread over the servers. A server takes free leases up to its
+    fair share of the registered clients, counted over the servers that
+    heartbeated within the lease period, renews them every third of it and
+    gives idle ones back when a new server brings its share down.
+
+    Entries stay pending in the group until `ack`ed, which the server does
+    once their TTS was pushed. A lease is only free when its holder gave it
+    back with nothing in flight or stopped renewing it, so whatever is
+    still pending on a newly leased stream was left by a dead server and is
+    claimed and yielded before any new entries.
+
+    Registration events, published to every server, trigger a balance as
+    soon as the current read returns, so a new client waits at most
+    `block_ms` for a server; the periodic balance is the fallback for
+    missed events.
+
+    Args:
+        redis: asyncio redis client.
+        registry (ClientRegistry, optional): reloaded when the registered
+            clients change.
+        consumer (str, optional): name in the group, hostname-pid by default.
+        lease_ms (int, optional): lease period.
+        block_ms (int, optional): XREADGROUP block time, well under lease_ms.
+        count (int, optional): entries read per stream and call.
+    """
+
+    def __init__(self, redis, registry=None,
+                 consumer: str = INGEST_CONSUMER,
+                 lease_ms: int = INGEST_LEASE_MS,
+                 block_ms: int = 1000,
+                 count: int = 16) -> None:
+        self.redis = redis
+        self.registry = registry
+        self.consumer = consumer or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_ms = lease_ms
+        self.block_ms = min(block_ms, lease_ms // 3)
+        self.count = count
+        self.uuids: typing.List[str] = []
+        self.leases: typing.Set[str] = set()
+        # Newly leased clients whose pending entries are not claimed yet
+        self._unclaimed: typing.List[str] = []
+        # Entries yielded and not acknowledged yet, per client
+        self._inflight: typing.Counter[str] = collections.Counter()
+        self.gaps = UplinkGaps()
+        self._balanced = 0.0
+        # Set by `_watch_events` when the registered clients changed
+        self._wake = asyncio.Event()
+        self._watcher: typing.Optional[asyncio.Task] = None
+
+    async def refresh(self) -> None:
+        uuids = sorted(u.decode('utf-8')
+                       for u in await self.redis.smembers(CLIENTS_KEY))
+        if uuids == self.uuids:
+            return
+        self.uuids = uuids
+        logging.info(f"uuids: {self.uuids}")
+        if self.registry is not None:
+            await self.registry.load(self.uuids)
+
+    async def _create_group(self, client_uuid: str) -> None:
+        try:
+            await self.redis.xgroup_create(audio_stream_key(client_uuid),
+                                           AUDIO_GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def _release(self, client_uuid: str) -> None:
+        await self.redis.eval(RELEASE_LEASE, 1, lease_key(client_uuid),
+                              self.consumer)
+        self.leases.discard(client_uuid)
+        self.gaps.forget(client_uuid)
+        logging.info(f"released {client_uuid}")
+
+    async def _balance(self) -> None:
+        """ Heartbeat, renew the held leases, then give back or take leases
+        towards this server's fair share.
+        """
+        await self.refresh()
+        now = int(time.time() * 1000)
+        held = sorted(self.leases)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(SERVERS_KEY, {self.consumer: now})
+            pipe.zremrangebyscore(SERVERS_KEY, 0, now - self.lease_ms)
+            pipe.zcard(SERVERS_KEY)
+            for client_uuid in held:
+                pipe.eval(RENEW_LEASE, 1, lease_key(client_uuid),
+                          self.consumer, self.lease_ms)
+            replies = await pipe.execute()
+        for client_uuid, renewed in zip(held, replies[3:]):
+            if not renewed:
+                logging.warning(f"lost the lease of {client_uuid}")
+                self.leases.discard(client_uuid)
+                self.gaps.forget(client_uuid)
+        fair = -(-len(self.uuids) // max(replies[2], 1))
+        for client_uuid in held:
+            if client_uuid in self.leases and not self._inflight[client_uuid] \
+                    and (client_uuid not in self.uuids or len(self.leases) > fair):
+                await self._release(client_uuid)
+        for client_uuid in self.uuids:
+            if len(self.leases) >= fair:
+                break
+            if client_uuid in self.leases:
+                continue
+            if await self.redis.set(lease_key(client_uuid), self.consumer,
+                                    nx=True, px=self.lease_ms):
+                await self._create_group(client_uuid)
+                self.leases.add(client_uuid)
+                self._unclaimed.append(client_uuid)
+                logging.info(f"leased {client_uuid}")
+
+    async def _claim(self, client_uuid: str) -> typing.List[tuple]:
+        """ Everything pending on a newly leased stream, oldest first. """
+        key, start, entries = audio_stream_key(client_uuid), '0-0', []
+        while True:
+            reply = await self.redis.xautoclaim(key, AUDIO_GROUP, self.consumer,
+                                                min_idle_time=0, start_id=start,
+                                                count=self.count)
+            start = reply[0].decode('utf-8') if isinstance(reply[0], bytes) else reply[0]
+            # Entries trimmed away while pending come back without fields
+            entries += [(i, f) for i, f in reply[1] if f]
+            if start == '0-0':
+                break
+        if entries:
+            logging.info(f"claimed {len(entries)} pending entries of {client_uuid}")
+        return entries
+
+    def _entry(self, client_uuid: str, entry_id, fields: dict):
+        self._inflight[client_uuid] += 1
+        self.gaps.observe(client_uuid, fields[b'audio'])
+        return (client_uuid, fields[b'audio'],
+                functools.partial(self.ack, client_uuid, entry_id))
+
+    async def ack(self, client_uuid: str, entry_id) -> None:
+        self._inflight[client_uuid] -= 1
+        try:
+            await self.redis.xack(audio_stream_key(client_uuid), AUDIO_GROUP,
+                                  entry_id)
+        except RedisError as e:
+            # Stays pending and is processed again by the next leaseholder
+            logging.error(f"Failed to acknowledge {entry_id} of {client_uuid}: {e}")
+
+    async def _watch_events(self) -> None:
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(EVENTS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self._wake.set()
+            except RedisError as e:
+                # The periodic balance still finds new clients meanwhile
+                logging.error(f"Registration events lost: {e}")
+                await asyncio.sleep(self.block_ms / 1000)
+
+    async def close(self) -> None:
+        """ Give back every lease and leave the live servers, so that the
+        remaining servers take over without waiting for the leases to lapse.
+        """
+        if self._watcher is not None:
+            self._watcher.cancel()
+        for client_uuid in sorted(self.leases):
+            await self._release(client_uuid)
+        await self.redis.zrem(SERVERS_KEY, self.consumer)
+
+    async def __aiter__(self) -> typing.AsyncIterator[
+            typing.Tuple[str, bytes, typing.Callable[[], typing.Awaitable]]]:
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch_events())
+        while True:
+            if self._wake.is_set() \
+                    or time.monotonic() - self._balanced >= self.lease_ms / 3000:
+                self._wake.clear()
+                await self._balance()
+                self._balanced = time.monotonic()
+            while self._unclaimed:
+                client_uuid = self._unclaimed.pop(0)
+                for entry_id, fields in await self._claim(client_uuid):
+                    yield self._entry(client_uuid, entry_id, fields)
+            if not self.leases:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.block_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            streams = {audio_stream_key(u): '>' for u in sorted(self.leases)}
+            try:
+                replies = await self.redis.xreadgroup(
+                    AUDIO_GROUP, self.consumer, streams,
+                    count=self.count, block=self.block_ms)
+            except ResponseError as e:
+                # The stream expired with its group while the client was quiet
+                if 'NOGROUP' not in str(e):
+                    raise
+                for client_uuid in self.leases:
+                    await self._create_group(client_uuid)
+                continue
+            for key, entries in replies or []:
+                client_uuid = key.decode('utf-8').rsplit(':', 1)[1]
+                for entry_id, fields in entries:
+                    yield self._entry(client_uuid, entry_id, fields)
+
+
+class SharedAck:
+    """ Acknowledge one ingest entry once all work holding it let go.
+
+    A streaming chunk is transcribed in its client's queue but the
+    sentences it completes are translated and pushed behind a queue of
+    their own; each of them `hold`s the entry so it is acknowledged only
+    after the last of their TTS was pushed, or dropped.
+
+    Args:
+        ack (callable): acknowledges the entry, held once by its creator.
+    """
+
+    def __init__(self, ack: typing.Callable[[], typing.Awaitable]) -> None:
+        self._ack = ack
+        self._holders = 1
+
+    def hold(self) -> typing.Callable[[], typing.Awaitable]:
+        """ Take another hold, released by awaiting the returned callable. """
+        self._holders += 1
+        return self.release
+
+    async def release(self) -> None:
+        self._holders -= 1
+        if not self._holders:
+            await self._ack()
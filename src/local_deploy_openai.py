@@ -6,21 +6,19 @@
     pip3 install pyaudio webrtcvad faster-whisper
 
 运行方式:
-    python3 local_deploy.py
+    python3 -m src.local_deploy_openai
 """
 from faster_whisper import WhisperModel
 from io import BytesIO
 import typing
-import io
-import collections
-import wave
 import time
 
 import pyaudio
-import webrtcvad
 import logging
 from funasr import AutoModel  #添加标点的模型
 
+from .vad import VadSegmenter, stream_frames, to_wav
+
 #解决bug问题
 import os
 os.environ["KMP_DUPLICATE_LIB_OK"]="TRUE"
@@ -99,16 +97,16 @@ class AudioRecorder(object):
         self.sample_rate = sample_rate
         self.channels = channels
         self.chunk = chunk
+        self.frame_duration = frame_duration
         self.frame_size = (sample_rate * frame_duration // 1000)
-        self.__frames: typing.List[bytes] = []
 
     def __enter__(self) -> 'AudioRecorder':
-        self.vad = webrtcvad.Vad()
         # 设置 VAD 的敏感度。参数是一个 0 到 3 之间的整数。0 表示对非语音最不敏感，3 最敏感。
-        self.vad.set_mode(1)
+        self.segmenter = VadSegmenter(mode=1,
+                                      sample_rate=self.sample_rate,
+                                      frame_duration=self.frame_duration)
 
         self.audio = pyaudio.PyAudio()
-        self.sample_width = self.audio.get_sample_size(pyaudio.paInt16)
         self.stream = self.audio.open(format=pyaudio.paInt16,
                                       channels=self.channels,
                                       rate=self.sample_rate,
@@ -121,40 +119,13 @@ class AudioRecorder(object):
         self.stream.close()
         self.audio.terminate()
 
-    def __bytes__(self) -> bytes:
-        buf = io.BytesIO()
-        with wave.open(buf, 'wb') as wf:
-            wf.setnchannels(self.channels)
-            wf.setsampwidth(self.sample_width)
-            wf.setframerate(self.sample_rate)
-            wf.writeframes(b''.join(self.__frames))
-            self.__frames.clear()
-        return buf.getvalue()
-
     def __iter__(self):
         """ Record audio until silence is detected.
         """
-        MAXLEN = 30
-        watcher = collections.deque(maxlen=MAXLEN)
-        triggered, ratio = False, 0.5
-        while True:
-            frame = self.stream.read(self.frame_size)
-            is_speech = self.vad.is_speech(frame, self.sample_rate)
-            watcher.append(is_speech)
-            self.__frames.append(frame)
-            if not triggered:
-                num_voiced = len([x for x in watcher if x])
-                if num_voiced > ratio * watcher.maxlen:
-                    logging.info("start recording...")
-                    triggered = True
-                    watcher.clear()
-                    self.__frames = self.__frames[-MAXLEN:]
-            else:
-                num_unvoiced = len([x for x in watcher if not x])
-                if num_unvoiced > ratio * watcher.maxlen:
-                    logging.info("stop recording...")
-                    triggered = False
-                    yield bytes(self)
+        frames = stream_frames(self.stream, self.frame_size)
+        for pcm in self.segmenter.segments(frames):
+            logging.info("stop recording...")
+            yield to_wav(pcm, self.sample_rate)
 
 
 def main():
@@ -0,0 +1,139 @@
+"""
+In-process metrics. Histograms keep a bounded window of recent samples and
+report percentiles over it, which is enough to tune batching windows and
+pool sizes against latency without an external metrics stack. `serve`
+exposes the same snapshot over HTTP, in Prometheus text format at /metrics
+and as JSON at /metrics.json.
+"""
+import asyncio
+import collections
+import json
+import logging
+import typing
+
+
+class Histogram:
+    """ Sliding-window histogram.
+
+    Args:
+        name (str): metric name.
+        window (int, optional): number of recent samples kept for percentiles.
+    """
+
+    def __init__(self, name: str, window: int = 1024) -> None:
+        self.name = name
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> typing.Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': max(self.samples) if self.samples else 0.0,
+        }
+
+
+REGISTRY: typing.Dict[str, Histogram] = {}
+# Monotonic event counts such as shed work, reported under "counters"
+COUNTERS: typing.Dict[str, int] = collections.Counter()
+# Point-in-time values such as pool usage, read when a snapshot is taken
+GAUGES: typing.Dict[str, typing.Callable[[], typing.Dict[str, float]]] = {}
+
+
+def histogram(name: str) -> Histogram:
+    if name not in REGISTRY:
+        REGISTRY[name] = Histogram(name)
+    return REGISTRY[name]
+
+
+def incr(name: str, n: int = 1) -> None:
+    COUNTERS[name] += n
+
+
+def register_gauge(name: str,
+                   fn: typing.Callable[[], typing.Dict[str, float]]) -> None:
+    GAUGES[name] = fn
+
+
+def snapshot() -> typing.Dict[str, typing.Dict[str, float]]:
+    values = {name: h.snapshot() for name, h in REGISTRY.items()}
+    values.update((name, fn()) for name, fn in GAUGES.items())
+    if COUNTERS:
+        values['counters'] = dict(COUNTERS)
+    return dict(sorted(values.items()))
+
+
+def log_snapshot() -> None:
+    for name, values in snapshot().items():
+        summary = ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                            for k, v in values.items())
+        logging.info(f"metrics {name}: {summary}")
+
+
+def prometheus() -> str:
+    """ Snapshot in the Prometheus text exposition format. """
+    lines = []
+    for name, values in snapshot().items():
+        metric = 'sts_' + ''.join(c if c.isalnum() else '_' for c in name)
+        for key, value in values.items():
+            if not isinstance(value, (int, float)):
+                continue
+            if key.startswith('p') and key[1:].isdigit():
+                label = f'{{quantile="0.{key[1:]}"}}'
+                lines.append(f'{metric}{label} {value}')
+            else:
+                key = ''.join(c if c.isalnum() else '_' for c in key)
+                lines.append(f'{metric}_{key} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# HTTP routes of `serve`: path -> () -> (status, content type, body)
+ROUTES: typing.Dict[str, typing.Callable[[], typing.Tuple[int, str, str]]] = {
+    '/metrics': lambda: (200, 'text/plain; version=0.0.4', prometheus()),
+    '/metrics.json': lambda: (200, 'application/json', json.dumps(snapshot())),
+}
+STATUS = {200: 'OK', 404: 'Not Found', 503: 'Service Unavailable'}
+
+
+async def _handle(reader, writer) -> None:
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        parts = request.decode('latin-1').split()
+        path = parts[1].split('?')[0] if len(parts) > 1 else '/'
+        route = ROUTES.get(path)
+        status, content_type, body = route() if route else \
+            (404, 'text/plain', 'not found\n')
+        data = body.encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} {STATUS.get(status, "")}\r\n'
+                     f'Content-Type: {content_type}\r\n'
+                     f'Content-Length: {len(data)}\r\n'
+                     'Connection: close\r\n\r\n'.encode('latin-1') + data)
+        await writer.drain()
+    except Exception as e:
+        logging.warning(f"metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int):
+    """ Minimal HTTP endpoint for ROUTES on the running event loop. """
+    server = await asyncio.start_server(_handle, host, port)
+    logging.info(f"metrics on http://{host}:{port}/metrics")
+    return server
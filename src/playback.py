@@ -0,0 +1,233 @@
+"""
+Client-side playback of received TTS chunks.
+
+One PyAudio output stream stays open for the whole session and pulls audio
+from a callback, so chunks are played from memory without temp files or a
+player process per clip. Every speaker has a small jitter buffer that holds
+chunks until their turn by sequence number; concurrent speakers are either
+mixed or queued behind the one currently talking. A buffer is dropped once
+its speaker has been quiet for longer than a missing chunk is waited for.
+"""
+import collections
+import threading
+import time
+import typing
+
+import numpy as np
+
+from . import metrics
+from .audio import TTS_SAMPLE_RATE
+from .config import PLAYBACK_JITTER_MS, PLAYBACK_MAX_GAP_MS, PLAYBACK_MIX
+
+
+def resample(samples: np.ndarray, source_rate: int, target_rate: int) -> np.ndarray:
+    if source_rate == target_rate or not len(samples):
+        return samples
+    n = int(round(len(samples) * target_rate / source_rate))
+    positions = np.arange(n) * (source_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+class JitterBuffer:
+    """ Chunks of one speaker, released strictly in sequence order.
+
+    Playback of a new utterance starts `jitter` seconds after its first
+    chunk arrived, giving reordered or late chunks time to fill in. A chunk
+    still missing after `max_gap` seconds is skipped.
+    """
+
+    def __init__(self, jitter: float, max_gap: float,
+                 played: typing.Optional[collections.deque] = None) -> None:
+        self.jitter = jitter
+        self.max_gap = max_gap
+        self.played = played
+        self.chunks: typing.Dict[int, typing.Tuple[np.ndarray, float, float,
+                                                   typing.Optional[dict]]] = {}
+        self.next_seq: typing.Optional[int] = None
+        self.current: typing.Optional[np.ndarray] = None
+        self.pos = 0
+        self.gap_since: typing.Optional[float] = None
+        self.dropped = 0
+        # Last time a chunk arrived or samples were played
+        self.active = 0.0
+
+    @property
+    def idle(self) -> bool:
+        return not self.chunks and (self.current is None
+                                    or self.pos >= len(self.current))
+
+    def queued_samples(self) -> int:
+        pending = sum(len(c[0]) for c in self.chunks.values())
+        if self.current is not None:
+            pending += len(self.current) - self.pos
+        return pending
+
+    def put(self, seq: int, samples: np.ndarray, ts: float, now: float,
+            trace: typing.Optional[dict] = None) -> None:
+        if self.idle:
+            # New utterance, or the sender restarted its sequence
+            self.next_seq = None
+        elif self.next_seq is not None and seq < self.next_seq:
+            self.dropped += 1
+            return
+        self.chunks[seq] = (samples, ts, now, trace)
+        self.active = now
+
+    def _advance(self, now: float) -> bool:
+        if not self.chunks:
+            return False
+        if self.next_seq is None:
+            if now - min(c[2] for c in self.chunks.values()) < self.jitter:
+                return False
+            self.next_seq = min(self.chunks)
+        if self.next_seq not in self.chunks:
+            if self.gap_since is None:
+                self.gap_since = now
+            if now - self.gap_since < self.max_gap:
+                return False
+            self.dropped += min(self.chunks) - self.next_seq
+            self.next_seq = min(self.chunks)
+        self.gap_since = None
+        samples, ts, arrival, trace = self.chunks.pop(self.next_seq)
+        self.next_seq += 1
+        self.current, self.pos = samples, 0
+        metrics.histogram('playback.delay').observe(now - ts)
+        metrics.histogram('playback.buffered').observe(now - arrival)
+        if trace is not None and self.played is not None:
+            trace['play'] = now
+            self.played.append(trace)
+        return True
+
+    def read(self, n: int, now: float) -> typing.Optional[np.ndarray]:
+        """ Up to `n` samples that are due, or None when nothing is. """
+        parts = []
+        while n > 0:
+            if self.current is None or self.pos >= len(self.current):
+                if not self._advance(now):
+                    break
+            part = self.current[self.pos:self.pos + n]
+            self.pos += len(part)
+            n -= len(part)
+            parts.append(part)
+        if not parts:
+            return None
+        self.active = now
+        return np.concatenate(parts)
+
+    def stale(self, now: float) -> bool:
+        """ Idle for longer than a missing chunk is waited for. """
+        return self.idle and now - self.active > self.max_gap
+
+
+class Player:
+    """ Single output stream fed from per-speaker jitter buffers.
+
+    Args:
+        sample_rate (int, optional): output stream rate, chunks at other
+            rates are resampled.
+        jitter_ms (float, optional): wait before an utterance starts playing.
+        max_gap_ms (float, optional): wait for a missing chunk before
+            skipping it.
+        mix (bool, optional): mix concurrent speakers instead of queuing them.
+        block (int, optional): frames per output buffer.
+    """
+
+    def __init__(self,
+                 sample_rate: int = TTS_SAMPLE_RATE,
+                 jitter_ms: float = PLAYBACK_JITTER_MS,
+                 max_gap_ms: float = PLAYBACK_MAX_GAP_MS,
+                 mix: bool = PLAYBACK_MIX,
+                 block: int = 1024) -> None:
+        self.sample_rate = sample_rate
+        self.jitter = jitter_ms / 1000
+        self.max_gap = max_gap_ms / 1000
+        self.mix = mix
+        self.block = block
+        self._buffers: typing.Dict[str, JitterBuffer] = {}
+        # Chunks dropped by buffers evicted since
+        self._dropped = 0
+        # Traces of chunks that started playing, drained by `take_played`
+        self.played: collections.deque = collections.deque(maxlen=1000)
+        self._floor: typing.Optional[str] = None
+        self._lock = threading.Lock()
+        self._audio = None
+        self._stream = None
+        metrics.register_gauge('playback', self.stats)
+
+    def start(self) -> 'Player':
+        import pyaudio
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(format=pyaudio.paInt16,
+                                        channels=1,
+                                        rate=self.sample_rate,
+                                        output=True,
+                                        frames_per_buffer=self.block,
+                                        stream_callback=self._callback)
+        self._stream.start_stream()
+        return self
+
+    def close(self) -> None:
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._audio.terminate()
+            self._stream = self._audio = None
+
+    def put(self, speaker: str, seq: int, samples: np.ndarray,
+            sample_rate: int, ts: float,
+            trace: typing.Optional[dict] = None) -> None:
+        samples = resample(np.asarray(samples, dtype=np.float32),
+                           sample_rate, self.sample_rate)
+        with self._lock:
+            buffer = self._buffers.get(speaker)
+            if buffer is None:
+                buffer = self._buffers[speaker] = JitterBuffer(
+                    self.jitter, self.max_gap, self.played)
+            buffer.put(seq, samples, ts, time.time(), trace)
+
+    def take_played(self) -> typing.List[dict]:
+        traces = []
+        while self.played:
+            traces.append(self.played.popleft())
+        return traces
+
+    def render(self, n: int) -> np.ndarray:
+        """ Next `n` output samples, silence where nothing is due. """
+        out = np.zeros(n, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            if self.mix:
+                speakers = list(self._buffers)
+            else:
+                if self._floor is None or self._buffers[self._floor].idle:
+                    self._floor = next((s for s, b in self._buffers.items()
+                                        if not b.idle), None)
+                speakers = [self._floor] if self._floor else []
+            for speaker in speakers:
+                samples = self._buffers[speaker].read(n, now)
+                if samples is not None:
+                    out[:len(samples)] += samples
+        return np.clip(out, -1.0, 1.0, out=out)
+
+    def _evict(self, now: float) -> None:
+        for speaker in [s for s, b in self._buffers.items() if b.stale(now)]:
+            self._dropped += self._buffers.pop(speaker).dropped
+            if speaker == self._floor:
+                self._floor = None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        import pyaudio
+        pcm = (self.render(frame_count) * 32767).astype('<i2').tobytes()
+        return pcm, pyaudio.paContinue
+
+    def stats(self) -> typing.Dict[str, float]:
+        with self._lock:
+            buffers = list(self._buffers.values())
+            return {
+                'speakers': sum(not b.idle for b in buffers),
+                'queued_chunks': sum(len(b.chunks) for b in buffers),
+                'queued_seconds': sum(b.queued_samples() for b in buffers)
+                / self.sample_rate,
+                'dropped': self._dropped + sum(b.dropped for b in buffers),
+            }
@@ -0,0 +1,153 @@
+"""Redis key layout and registration helpers shared by the server and clients."""
+import typing
+
+CLIENTS_KEY = 'client_uuids'
+# Codecs the server can decode, for clients to negotiate their uplink codec
+SERVER_CODECS_KEY = 'STS:SERVER:CODECS'
+# Registration events, consumed by the server to refresh its ingest key set
+EVENTS_KEY = 'STS:EVENTS'
+EVENTS_MAXLEN = 1000
+# The same events published to every server, which wakes stream ingest
+EVENTS_CHANNEL = 'STS:EVENTS:CHANNEL'
+# Traces of played chunks reported back by listeners
+TRACES_KEY = 'STS:TRACES'
+TRACES_MAXLEN = 1000
+# Consumer group of the servers reading client audio streams, and the
+# servers seen alive, scored by their last heartbeat in milliseconds
+AUDIO_GROUP = 'sts-servers'
+SERVERS_KEY = 'STS:SERVERS'
+# Seconds until a server's readiness hash expires unless refreshed
+READY_TTL = 60
+# Room of clients that registered without one
+DEFAULT_ROOM = 'default'
+
+
+def audio_key(client_uuid: str) -> str:
+    return f'STS:AUDIOS:{client_uuid}'
+
+
+def audio_stream_key(client_uuid: str) -> str:
+    return f'STS:AUDIOSTREAM:{client_uuid}'
+
+
+def lease_key(client_uuid: str) -> str:
+    """ Name of the server currently reading a client's audio stream. """
+    return f'STS:LEASE:{client_uuid}'
+
+
+def ready_key(server: str) -> str:
+    """ Hash of the stages a server is serving, each with the seconds it
+    took from process start.
+    """
+    return f'STS:READY:{server}'
+
+
+def room_key(room: str, lang: str) -> str:
+    """ Stream of the TTS chunks of every speaker in a room, in one language. """
+    return f'STS:ROOM:{room}:{lang}'
+
+
+def seq_key(client_uuid: str, lang: str) -> str:
+    """ Sequence counter of a speaker's TTS chunks in one language. """
+    return f'STS:SEQ:{client_uuid}:{lang}'
+
+
+def partial_channel(client_uuid: str) -> str:
+    """ Pub/Sub channel of unstable streaming hypotheses. """
+    return f'STS:TEXT:PARTIAL:{client_uuid}'
+
+
+def final_channel(client_uuid: str) -> str:
+    """ Pub/Sub channel of committed streaming text. """
+    return f'STS:TEXT:FINAL:{client_uuid}'
+
+
+def client_key(client_uuid: str) -> str:
+    """ Hash of what a client published about itself, e.g. its codecs. """
+    return f'STS:CLIENT:{client_uuid}'
+
+
+def push_bounded(pipe, key: str, values: typing.Sequence[bytes],
+                 maxlen: int = 0, ttl: int = 0) -> int:
+    """ Queue an RPUSH onto a pipeline, trimmed to the newest `maxlen` items
+    (drop-oldest) and expiring `ttl` seconds after this write. Returns the
+    number of commands queued; the first reply is the list length after the
+    push, see `overflow`.
+    """
+    pipe.rpush(key, *values)
+    if maxlen:
+        pipe.ltrim(key, -maxlen, -1)
+    if ttl:
+        pipe.expire(key, ttl)
+    return 1 + bool(maxlen) + bool(ttl)
+
+
+def push_audio(pipe, client_uuid: str, blobs: typing.Sequence[bytes],
+               mode: str = 'list', maxlen: int = 0, ttl: int = 0) -> int:
+    """ Queue an upload of audio blobs for the server's ingest `mode`. List
+    mode is `push_bounded` onto `audio_key`; stream mode XADDs each blob to
+    `audio_stream_key`, trimmed to `maxlen` entries. Returns the number of
+    commands queued.
+    """
+    if mode != 'stream':
+        return push_bounded(pipe, audio_key(client_uuid), blobs, maxlen, ttl)
+    key = audio_stream_key(client_uuid)
+    for blob in blobs:
+        pipe.xadd(key, {'audio': blob}, maxlen=maxlen or None, approximate=False)
+    if ttl:
+        pipe.expire(key, ttl)
+    return len(blobs) + bool(ttl)
+
+
+def push_clip(pipe, room: str, lang: str, speaker: str, blob: bytes,
+              maxlen: int = 0, ttl: int = 0) -> int:
+    """ Queue the publication of one TTS chunk to a room, trimmed to the
+    newest `maxlen` entries. Listeners XREAD the stream at their own
+    offsets, so every one of them receives the chunk. Returns the number of
+    commands queued; with `maxlen` the first reply is the stream length
+    before the chunk was added, see `overflow`.
+    """
+    key = room_key(room, lang)
+    if maxlen:
+        pipe.xlen(key)
+    pipe.xadd(key, {'speaker': speaker, 'audio': blob},
+              maxlen=maxlen or None, approximate=False)
+    if ttl:
+        pipe.expire(key, ttl)
+    return 1 + bool(maxlen) + bool(ttl)
+
+
+def overflow(length: int, maxlen: int) -> int:
+    """ Items a bounded push dropped, from the length after the push. """
+    return max(0, length - maxlen) if maxlen else 0
+
+
+def encode_event(event: str, client_uuid: str) -> str:
+    return f'{event}:{client_uuid}'
+
+
+def decode_event(raw: bytes):
+    event, _, client_uuid = raw.decode('utf-8').partition(':')
+    return event, client_uuid
+
+
+async def register_client(redis, client_uuid: str,
+                          info: typing.Optional[typing.Dict[str, str]] = None) -> None:
+    async with redis.pipeline(transaction=True) as pipe:
+        if info:
+            pipe.hset(client_key(client_uuid), mapping=info)
+        pipe.sadd(CLIENTS_KEY, client_uuid)
+        pipe.rpush(EVENTS_KEY, encode_event('register', client_uuid))
+        pipe.ltrim(EVENTS_KEY, -EVENTS_MAXLEN, -1)
+        pipe.publish(EVENTS_CHANNEL, encode_event('register', client_uuid))
+        await pipe.execute()
+
+
+async def deregister_client(redis, client_uuid: str) -> None:
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.srem(CLIENTS_KEY, client_uuid)
+        pipe.delete(client_key(client_uuid))
+        pipe.rpush(EVENTS_KEY, encode_event('deregister', client_uuid))
+        pipe.ltrim(EVENTS_KEY, -EVENTS_MAXLEN, -1)
+        pipe.publish(EVENTS_CHANNEL, encode_event('deregister', client_uuid))
+        await pipe.execute()
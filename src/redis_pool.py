@@ -0,0 +1,88 @@
+"""
+One Redis connection pool per process, shared by the server and the
+clients. Opening a connection costs a TCP and TLS handshake, which on a
+remote ElastiCache endpoint is slower than the command itself, so every
+caller borrows from the same pool instead of calling `from_url`.
+"""
+import typing
+
+from redis import asyncio as aioredis
+
+from .config import REDIS_MAX_CONNECTIONS, REDIS_POOL_TIMEOUT, REDIS_SERVER
+
+_redis: typing.Optional[aioredis.Redis] = None
+
+
+class CountingPool(aioredis.BlockingConnectionPool):
+    """ Blocking pool that counts its connections through the public pool
+    methods, for `pool_stats`, instead of reading redis-py internals.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.created = 0
+        # Ids of the connections handed out; a connection that failed to
+        # connect is released without ever being handed out
+        self._checked_out: typing.Set[int] = set()
+
+    @property
+    def in_use(self) -> int:
+        return len(self._checked_out)
+
+    def make_connection(self):
+        self.created += 1
+        return super().make_connection()
+
+    async def get_connection(self, *args, **kwargs):
+        connection = await super().get_connection(*args, **kwargs)
+        self._checked_out.add(id(connection))
+        return connection
+
+    async def release(self, connection) -> None:
+        self._checked_out.discard(id(connection))
+        await super().release(connection)
+
+
+def get_redis() -> aioredis.Redis:
+    """ Shared client, created on first use in the running process. Blocking
+    commands (BLPOP) hold a connection for their whole wait, so the pool
+    blocks for up to REDIS_POOL_TIMEOUT seconds rather than failing when
+    every connection is busy.
+    """
+    global _redis
+    if _redis is None:
+        pool = CountingPool.from_url(
+            REDIS_SERVER,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT)
+        _redis = aioredis.Redis(connection_pool=pool)
+    return _redis
+
+
+def set_redis(client: aioredis.Redis) -> None:
+    """ Install the shared client, e.g. a fakeredis stand-in for offline
+    benchmarks. Must be called before anything else uses `get_redis`.
+    """
+    global _redis
+    _redis = client
+
+
+def pool_stats() -> typing.Dict[str, int]:
+    pool = _redis.connection_pool if _redis is not None else None
+    if not isinstance(pool, CountingPool):
+        # Not created yet, or a stand-in installed with `set_redis`
+        return {'max': REDIS_MAX_CONNECTIONS, 'created': 0, 'in_use': 0,
+                'idle': 0}
+    return {
+        'max': pool.max_connections,
+        'created': pool.created,
+        'in_use': pool.in_use,
+        'idle': pool.created - pool.in_use,
+    }
+
+
+async def close_redis() -> None:
+    global _redis
+    if _redis is not None:
+        await _redis.connection_pool.disconnect()
+        _redis = None
@@ -0,0 +1,70 @@
+import logging
+import typing
+
+from .protocol import DEFAULT_ROOM, client_key
+
+
+class ClientRegistry:
+    """ Registered clients and the info each published in its
+    `STS:CLIENT:{uuid}` hash, kept in sync from registration events so that
+    the server never has to query it per utterance.
+    """
+
+    def __init__(self, redis) -> None:
+        self.redis = redis
+        self.clients: typing.Dict[str, typing.Dict[str, str]] = {}
+
+    async def load(self, uuids: typing.Iterable[str]) -> None:
+        uuids = list(uuids)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for client_uuid in uuids:
+                pipe.hgetall(client_key(client_uuid))
+            infos = await pipe.execute()
+        self.clients = {u: self._decode(info) for u, info in zip(uuids, infos)}
+
+    @staticmethod
+    def _decode(info: dict) -> typing.Dict[str, str]:
+        return {k.decode('utf-8'): v.decode('utf-8') for k, v in info.items()}
+
+    async def handle(self, event: str, client_uuid: str) -> None:
+        if event == 'register':
+            info = await self.redis.hgetall(client_key(client_uuid))
+            self.clients[client_uuid] = self._decode(info)
+        elif event == 'deregister':
+            self.clients.pop(client_uuid, None)
+        logging.info(f"registry {event} {client_uuid}: "
+                     f"{self.clients.get(client_uuid)}")
+
+    def profile(self, client_uuid: str) -> typing.Dict[str, str]:
+        """ Session profile of a client: its hash fields, e.g. lang, prompt,
+        beam_size and vad_mode.
+        """
+        return self.clients.get(client_uuid) or {}
+
+    def codecs(self, client_uuid: str) -> typing.List[str]:
+        info = self.clients.get(client_uuid) or {}
+        return info.get('codecs', 'pcm').split(',')
+
+    def room(self, client_uuid: str) -> str:
+        info = self.clients.get(client_uuid) or {}
+        return info.get('room', DEFAULT_ROOM)
+
+    def members(self, room: str) -> typing.List[str]:
+        return [u for u in self.clients if self.room(u) == room]
+
+    def lang(self, client_uuid: str) -> typing.Optional[str]:
+        info = self.clients.get(client_uuid) or {}
+        return info.get('lang')
+
+    def listener_langs(self, client_uuid: str,
+                       supported: typing.Sequence[str]) -> typing.List[str]:
+        """ Languages of the other listeners in a speaker's room, in the
+        order of `supported` and without the speaker's own language. A
+        client that did not publish its language may listen to any of them.
+        """
+        wanted = set()
+        for u in self.members(self.room(client_uuid)):
+            if u != client_uuid:
+                wanted.update([self.lang(u)] if self.lang(u) else supported)
+        wanted.discard(self.lang(client_uuid))
+        return [lang for lang in supported if lang in wanted]
@@ -1,119 +1,411 @@
 import asyncio
+import functools
+import json
 import logging
+import os
+import socket
 import time
+import typing
 from collections import deque
 
-from redis import asyncio as aioredis
-from faster_whisper import WhisperModel
-import soundfile
-
-from .config import REDIS_SERVER
-from .utils import asyncformer
-from .translate import translate
-from .tts import tts
+from . import codec, metrics, tracing, wire
+from .asr import ASRPool, DecodeOptions
+from .audio import SAMPLE_RATE, TTS_SAMPLE_RATE
+from .config import (AUDIO_CODECS, AUDIO_DEADLINE_S, INGEST_CONSUMER,
+                     INGEST_MODE, METRICS_HOST, METRICS_INTERVAL,
+                     METRICS_PORT, QUEUE_TTL, SERVER_QUEUE_MAXLEN,
+                     TTS_QUEUE_MAXLEN)
+from .executors import run_in
+from .ingest import AudioIngest, SharedAck, StreamIngest
+from .protocol import (READY_TTL, SERVER_CODECS_KEY, TRACES_KEY, audio_key,
+                       audio_stream_key, final_channel, overflow,
+                       partial_channel, push_clip, ready_key, room_key, seq_key)
+from .redis_pool import close_redis, get_redis, pool_stats
+from .registry import ClientRegistry
+from .streaming import StreamingSession, hypothesis_message
+from .translate import LANGS, Translator
 
 CONVERSATION = deque(maxlen=100)
-MODEL_SIZE = "large-v3"
 CN_PROMPT = '聊一下基于faster-whisper的实时/低延迟语音转写服务'
 logging.basicConfig(level=logging.INFO)
-model = WhisperModel(MODEL_SIZE, num_workers=4, device="auto", compute_type="default")
-logging.info('Model loaded')
-logging.getLogger("faster_whisper").setLevel(logging.ERROR)
-
-
-async def transcribe(uuid, audio_content):
-    # Transcribe audio to text
-    def b_transcribe(fname):
-        start_time = time.time()
-        segments, info = model.transcribe(fname,
-                                          beam_size=5,
-                                          no_speech_threshold=0.8,
-                                          repetition_penalty=2
-                                          )
-        end_time = time.time()
-        period = end_time - start_time
-        text = ''
-        if info.language_probability < 0.8:
-            return text, period
-
-        for segment in segments:
-            t = segment.text
-            if t.strip().replace('.', ''):
-                text += ', ' + t if text else t
-        return text, period
-
-    tmp = tempfile.NamedTemporaryFile(dir=".",suffix=".wav")
-    logging.info(f"audio temp file: {tmp.name}")
-    tmp.write(audio_content)
-    text, _period = await asyncformer(b_transcribe,tmp.name)
-    tmp.close()
+
+asr_pool: typing.Optional[ASRPool] = None
+translator: typing.Optional[Translator] = None
+registry: typing.Optional[ClientRegistry] = None
+# Pending work per key, drained in order by one task per key
+_client_queues: typing.Dict[str, asyncio.Queue] = {}
+_client_tasks: typing.Dict[str, asyncio.Task] = {}
+# Streaming sessions of clients currently sending chunks, and when each
+# last received one
+_sessions: typing.Dict[str, StreamingSession] = {}
+_session_seen: typing.Dict[str, float] = {}
+# A session without chunks for this long lost its last one and is dropped
+SESSION_IDLE_S = AUDIO_DEADLINE_S or QUEUE_TTL
+# This server's name in the ingest group and its readiness hash
+SERVER_NAME = INGEST_CONSUMER or f'{socket.gethostname()}-{os.getpid()}'
+# Stages that must be serving before the server is ready, and the seconds
+# from process start until each one was
+STAGES = ('asr', 'tts', 'ingest')
+STARTED = time.time()
+_ready: typing.Dict[str, float] = {}
+
+
+def expired(frame, deadline=AUDIO_DEADLINE_S):
+    # Legacy blobs carry no timestamp and are never skipped
+    return bool(deadline and frame.ts and time.time() - frame.ts > deadline)
+
+
+async def transcribe(uuid, audio_content, dequeued=None, entry=None):
+    frame = wire.unpack(audio_content)
+    trace = frame.trace or tracing.new_trace()
+    tracing.stamp(trace, 'dequeue', dequeued)
+    if expired(frame):
+        # Too late to be useful, skip it rather than fall further behind
+        metrics.incr('shed.audio.deadline')
+        logging.warning(f"Skipped audio from {uuid} queued "
+                        f"{time.time() - frame.ts:.1f}s ago")
+        if frame.stream and frame.last:
+            end_session(uuid)
+        return
+    if frame.stream:
+        return await transcribe_stream(uuid, audio_content, trace, entry)
+    # Transcribe audio to text, with the speaker's language and decoding
+    # settings from its session profile
+    text, period = await asr_pool.transcribe(
+        audio_content, DecodeOptions.from_profile(registry.profile(uuid)))
+    tracing.stamp(trace, 'asr')
+    logging.info(f"ASR time [{uuid}]: {period:.3f}")
+    await process_text(uuid, text, trace)
+
+
+async def transcribe_stream(uuid, audio_content, trace, entry=None):
+    """ Feed one chunk to the client's streaming session, publish the
+    partial and newly committed hypotheses, and hand finished sentences on
+    to translation. Translation runs behind its own per-client queue so the
+    next chunk is not held up by it; every sentence holds the chunk's
+    ingest `entry` until its TTS was pushed.
+    """
+    frame, samples = wire.decode(audio_content, SAMPLE_RATE)
+    session = _sessions.get(uuid)
+    if session is None:
+        options = DecodeOptions.from_profile(registry.profile(uuid))
+        session = _sessions[uuid] = StreamingSession(
+            functools.partial(asr_pool.transcribe_words, options=options))
+    time_asr_begin = _session_seen[uuid] = time.time()
+    try:
+        committed, partial, sentences = await session.feed(samples, frame.last)
+    finally:
+        if frame.last:
+            end_session(uuid)
+    tracing.stamp(trace, 'asr')
+    logging.info(f"Streaming ASR time [{uuid}]: {trace['asr'] - time_asr_begin:.3f}")
+    async with get_redis().pipeline(transaction=False) as pipe:
+        pipe.publish(partial_channel(uuid), hypothesis_message(partial, frame.seq))
+        if committed:
+            pipe.publish(final_channel(uuid),
+                         hypothesis_message(committed, frame.seq))
+        await pipe.execute()
+    for sentence in sentences:
+        dispatch(f'{uuid}:text', process_text, uuid, sentence, dict(trace),
+                 done=entry and entry.hold())
+
+
+def end_session(uuid):
+    _sessions.pop(uuid, None)
+    _session_seen.pop(uuid, None)
+
+
+async def expire_sessions(idle=SESSION_IDLE_S):
+    """ Drop the streaming sessions of clients that deregistered or sent
+    nothing for `idle` seconds, e.g. because their last chunk was shed.
+    """
+    while True:
+        await asyncio.sleep(idle / 2)
+        now = time.time()
+        for uuid in list(_sessions):
+            if uuid not in registry.clients or now - _session_seen[uuid] > idle:
+                logging.warning(f"Dropped the idle streaming session of {uuid}")
+                metrics.incr('streaming.expired')
+                end_session(uuid)
+
+
+async def process_text(uuid, text, trace):
+    """ Translate transcribed text into the languages the speaker's room
+    listens to and push the synthesized speech.
+    """
     t = text.strip().replace('.', '')
     if not t:
         return
 
     logging.info(f"Transcribed [{uuid}]: {t}")
     CONVERSATION.append(text)
+    # Only what someone else in the room listens to is worth translating
+    # and synthesizing
+    langs = registry.listener_langs(uuid, LANGS)
+    if len(langs) < len(LANGS):
+        metrics.incr('demand.skipped_langs', len(LANGS) - len(langs))
+    if not langs:
+        logging.info(f"No listener for [{uuid}], skipped translation")
+        return
     time_translate_begin = time.time()
-    translated = translate(text)
+    translated = await translator.translate(text, langs)
+    tracing.stamp(trace, 'translate')
     logging.info(f"Translated [{uuid}]: {translated}")
-    time_translate_end = time.time()
-    logging.info(f"Translate time: {time_translate_begin - time_translate_end}")
-    tasks = []
+    logging.info(f"Translate time: {trace['translate'] - time_translate_begin:.3f}")
+    # A failed or partial translation comes back empty, there is nothing
+    # to synthesize for it
+    translated = {lang: t for lang, t in translated.items() if t.strip()}
+    if len(translated) < len(langs):
+        metrics.incr('translate.empty', len(langs) - len(translated))
+        logging.warning(f"Empty translation [{uuid}] for "
+                        f"{[lang for lang in langs if lang not in translated]}")
     for lang in translated:
-        lang_text = translated[lang]
-        logging.info(f"TTS [{uuid}, {lang}]: {lang_text}")
-        tasks.append(tts_and_push(lang_text, lang, uuid))
+        logging.info(f"TTS [{uuid}, {lang}]: {translated[lang]}")
+    await tts_and_push(translated, uuid, trace)
+
+
+async def synthesize(text, lang, audio_codec):
+    from .tts import tts_cache, tts_worker
+    wav = await tts_cache.get(text, lang, audio_codec)
+    if wav is None:
+        wav = await tts_worker.synthesize(text, audio_codec)
+        await tts_cache.set(text, lang, audio_codec, wav)
+    return wav
 
-    await asyncio.gather(*tasks)
 
-import tempfile
+def downlink_codec(room):
+    """ First of AUDIO_CODECS that every listener in the room can decode. """
+    name = codec.negotiate(AUDIO_CODECS,
+                           [registry.codecs(u) for u in registry.members(room)])
+    return codec.CODECS[name]
 
-async def tts_and_push(text, lang, uuid):
+
+async def reserve_seqs(uuid, counts):
+    """ First sequence number of `counts[lang]` consecutive chunks per
+    language. The counters live in Redis so that a speaker's sequence goes
+    on where it was when another server takes the client over.
+    """
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for lang, n in counts.items():
+            pipe.incrby(seq_key(uuid, lang), n)
+            pipe.expire(seq_key(uuid, lang), QUEUE_TTL)
+        ends = (await pipe.execute())[::2]
+    return {lang: end - n for (lang, n), end in zip(counts.items(), ends)}
+
+
+async def tts_and_push(translated, uuid, trace):
+    """ Synthesize every translation sentence by sentence and push each
+    chunk as soon as it is ready to the speaker's room, once per language.
+    The first piece of every language goes out alone so listeners hear it
+    early; the remaining pieces are submitted together and batched by the
+    TTS worker. Chunks of the same round share one pipelined round trip.
+
+    Every chunk carries a copy of the utterance trace with its own tts and
+    push times; the server-side stages are recorded for the first round,
+    i.e. up to the first audio leaving the server.
+    """
+    from .tts import split_sentences
     time_tts_begin = time.time()
-    wav = tts(text)
-    tmp = tempfile.NamedTemporaryFile(dir=".",suffix=".wav")
-    logging.info(f"tts temp file: {tmp.name}")
-    soundfile.write(tmp, wav, 24000,format="WAV")
-    tmp.seek(0)
-    async with aioredis.from_url(REDIS_SERVER) as redis:
-        await redis.rpush(f'STS:{lang}:{uuid}', tmp.read())
-        logging.info(f'Sync {lang} TTS to STS:{lang}:{uuid}')
-    tmp.close()
+    pieces = {lang: split_sentences(text) for lang, text in translated.items()}
+    pieces = {lang: p for lang, p in pieces.items() if p}
+    if not pieces:
+        return
+    room = registry.room(uuid)
+    audio_codec = downlink_codec(room)
+    futures = {lang: [asyncio.ensure_future(synthesize(p[0], lang, audio_codec))]
+               for lang, p in pieces.items()}
+    seqs = await reserve_seqs(uuid, {lang: len(p) for lang, p in pieces.items()})
+    for i in range(max(len(p) for p in pieces.values())):
+        langs = [lang for lang in pieces if i < len(pieces[lang])]
+        wavs = await asyncio.gather(*(futures[lang][i] for lang in langs))
+        if i == 0:
+            for lang, p in pieces.items():
+                futures[lang].extend(
+                    asyncio.ensure_future(synthesize(t, lang, audio_codec))
+                    for t in p[1:])
+            logging.info(f"tts first chunk [{uuid}]: {time.time() - time_tts_begin:.3f}")
+        chunk_trace = tracing.stamp(dict(trace), 'tts')
+        tracing.stamp(chunk_trace, 'push')
+        if i == 0:
+            tracing.observe(chunk_trace)
+        async with get_redis().pipeline(transaction=False) as pipe:
+            # Reply index of each clip's stream length before its XADD
+            offsets, n = [], 0
+            for lang, wav in zip(langs, wavs):
+                last = i == len(pieces[lang]) - 1
+                offsets.append(n)
+                n += push_clip(pipe, room, lang, uuid,
+                               wire.pack(wav, seq=seqs[lang] + i, last=last,
+                                         codec=audio_codec,
+                                         sample_rate=TTS_SAMPLE_RATE,
+                                         trace=chunk_trace),
+                               TTS_QUEUE_MAXLEN, QUEUE_TTL)
+            replies = await pipe.execute()
+        if TTS_QUEUE_MAXLEN:
+            shed = sum(overflow(replies[n] + 1, TTS_QUEUE_MAXLEN)
+                       for n in offsets)
+            if shed:
+                metrics.incr('shed.tts.queue', shed)
+    logging.info(f'Sync TTS {[(lang, len(p)) for lang, p in pieces.items()]} '
+                 f'chunks to {[room_key(room, lang) for lang in pieces]}')
 
     time_tts_end = time.time()
-    logging.info(f"tts time: {time_tts_begin - time_tts_end}")
-
+    logging.info(f"tts time: {time_tts_end - time_tts_begin:.3f}")
 
 
 async def receive_audio():
-    async with aioredis.from_url(REDIS_SERVER) as redis:
-        while True:
-            # Get all UUIDs from Redis
-            uuids = await redis.smembers('client_uuids')
-            logging.info(f"uuids: {uuids}")
-            if not uuids:
-                await asyncio.sleep(1)
-                continue
-
-            for uuidb in uuids:
-                uuid = uuidb.decode('utf-8')
-                channel = f'STS:AUDIOS:{uuid}'
-                logging.info(f"channel: {channel}")
-                # length = await redis.llen(channel)
-                # if length > 10:
-                #     await redis.expire(channel, 1)
-
-                content = await redis.blpop(channel, timeout=0.1)
-                if content is None:
-                    logging.info(f"No content available in {channel}")
-                    continue
-
-                audio_content = content[1]
-                await transcribe(uuid, audio_content)
+    redis = get_redis()
+    # Advertise what the ASR side can decode, clients negotiate against it
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.delete(SERVER_CODECS_KEY)
+        pipe.sadd(SERVER_CODECS_KEY, *codec.available())
+        await pipe.execute()
+    if INGEST_MODE == 'stream':
+        ingest, key = StreamIngest(redis, registry, SERVER_NAME), audio_stream_key
+    else:
+        ingest, key = AudioIngest(redis, registry), audio_key
+    await mark_ready('ingest')
+    try:
+        async for uuid, audio_content, ack in ingest:
+            logging.info(f"Received audio from {key(uuid)}")
+            # A stream entry is acknowledged once its TTS was pushed, for
+            # streaming chunks that of the sentences they completed
+            entry = SharedAck(ack) if ack else None
+            dispatch(uuid, transcribe, uuid, audio_content, time.time(), entry,
+                     done=entry and entry.release)
+    finally:
+        if INGEST_MODE == 'stream':
+            await ingest.close()
+
+
+def dispatch(key, fn, *args, done=None):
+    """ Queue `fn(*args)` behind earlier work of the same key. Each key is
+    drained by its own task, so one client's utterances stay in order while
+    different clients are transcribed in parallel by the ASR pool. At most
+    SERVER_QUEUE_MAXLEN items wait per key. `done()` is awaited once the
+    item was processed, failed or was dropped.
+    """
+    queue = _client_queues.get(key)
+    if queue is None:
+        queue = _client_queues[key] = asyncio.Queue()
+        _client_tasks[key] = asyncio.create_task(_drain_client(key, queue))
+    if SERVER_QUEUE_MAXLEN and queue.qsize() >= SERVER_QUEUE_MAXLEN:
+        # Drop the oldest, a backlog only delays everything behind it
+        _, _, dropped = queue.get_nowait()
+        metrics.incr('shed.server.queue')
+        if dropped is not None:
+            asyncio.ensure_future(dropped())
+    queue.put_nowait((fn, args, done))
+
+
+async def _drain_client(key, queue):
+    try:
+        while not queue.empty():
+            fn, args, done = queue.get_nowait()
+            try:
+                await fn(*args)
+            except Exception as e:
+                logging.error(f"Failed to process audio from {key}: {e}",
+                              exc_info=True)
+            if done is not None:
+                await done()
+    finally:
+        del _client_queues[key]
+        del _client_tasks[key]
+
+
+async def collect_traces():
+    """ Record the playout stages listeners report for pushed chunks. """
+    redis = get_redis()
+    while True:
+        _, raw = await redis.blpop(TRACES_KEY, timeout=0)
+        try:
+            tracing.observe_playout(json.loads(raw))
+        except ValueError as e:
+            logging.warning(f"Bad trace report: {e}")
+
+
+async def report_metrics(interval=METRICS_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        metrics.log_snapshot()
+
+
+async def mark_ready(stage):
+    """ Record that `stage` is serving, in `/ready` and in this server's
+    readiness hash.
+    """
+    _ready[stage] = time.time() - STARTED
+    logging.info(f"{stage} ready after {_ready[stage]:.1f}s")
+    async with get_redis().pipeline(transaction=False) as pipe:
+        pipe.hset(ready_key(SERVER_NAME), stage, f'{_ready[stage]:.3f}')
+        pipe.expire(ready_key(SERVER_NAME), READY_TTL)
+        await pipe.execute()
+
+
+async def report_ready(interval=READY_TTL / 3):
+    # Keep the readiness hash alive for as long as this server runs
+    while True:
+        await asyncio.sleep(interval)
+        await get_redis().expire(ready_key(SERVER_NAME), READY_TTL)
+
+
+def readiness():
+    """ `/ready` route: 200 once every stage is serving, 503 before. """
+    status = 200 if all(s in _ready for s in STAGES) else 503
+    return status, 'application/json', json.dumps(
+        {'server': SERVER_NAME, 'ready': status == 200, 'stages': _ready})
+
+
+def setup():
+    """ Create the pipeline stages. Redis, translation and TTS backends
+    come from config, or from `redis_pool.set_redis` for the Redis client.
+    Models are loaded by `start`, or on first use without it.
+    """
+    global asr_pool, translator, registry
+    asr_pool = ASRPool()
+    translator = Translator()
+    registry = ClientRegistry(get_redis())
+    metrics.register_gauge('redis.pool', pool_stats)
+    metrics.ROUTES['/ready'] = readiness
+    # ChatTTS is imported here rather than at module level: the spawned ASR
+    # workers re-import this module and must not load it.
+    from . import tts  # noqa: F401
+
+
+async def start():
+    """ Load the ASR workers and the TTS model in parallel, the former in
+    their own processes and the latter on the tts executor thread, warming
+    them up as STARTUP_WARMUP says.
+    """
+    from . import tts
+
+    async def start_asr():
+        await asr_pool.start()
+        await mark_ready('asr')
+
+    async def start_tts():
+        await run_in('tts', tts.load)
+        await mark_ready('tts')
+
+    await asyncio.gather(start_asr(), start_tts())
 
 
 async def main():
-    await asyncio.gather(receive_audio())
+    setup()
+    if METRICS_PORT:
+        await metrics.serve(METRICS_HOST, METRICS_PORT)
+    try:
+        # Audio is only taken once the models are loaded, in stream mode the
+        # other servers keep serving the clients meanwhile
+        await start()
+        await asyncio.gather(receive_audio(), collect_traces(),
+                             report_metrics(), report_ready(),
+                             expire_sessions())
+    finally:
+        asr_pool.shutdown()
+        await get_redis().delete(ready_key(SERVER_NAME))
+        await close_redis()
 
 
 if __name__ == '__main__':
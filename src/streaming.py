@@ -0,0 +1,149 @@
+"""
+Incremental transcription of chunked audio streams.
+
+Clients in streaming mode send fixed-size chunks (STREAM_CHUNK_MS) instead
+of whole utterances. Every session keeps a rolling buffer that is
+re-decoded on each new chunk. A word is committed once two consecutive
+decodes agree on it (local agreement), the unstable tail is published as a
+partial hypothesis, and the audio before the last committed word is
+trimmed from the buffer so decoding cost stays bounded.
+"""
+import json
+import re
+import time
+import typing
+
+import numpy as np
+
+from .audio import SAMPLE_RATE
+
+Word = typing.Tuple[float, float, str]
+
+# Committed text is handed on for translation at sentence ends
+SENTENCE_END = re.compile(r'[。！？.!?]\s*$')
+PROMPT_CHARS = 200
+# Whisper decodes at most 30 s at once; commit whatever is there beyond that
+MAX_BUFFER_SECONDS = 25
+
+
+def _norm(word: str) -> str:
+    return word.strip().lower().strip('.,!?;:，。！？；：')
+
+
+class HypothesisBuffer:
+    """ Local agreement between consecutive hypotheses. Word times are
+    absolute seconds since the start of the session.
+    """
+
+    def __init__(self) -> None:
+        self.committed_in_buffer: typing.List[Word] = []
+        self.buffer: typing.List[Word] = []
+        self.new: typing.List[Word] = []
+        self.last_committed_time = 0.0
+
+    def insert(self, words: typing.List[Word], offset: float) -> None:
+        words = [(a + offset, b + offset, t) for a, b, t in words]
+        self.new = [w for w in words if w[0] > self.last_committed_time - 0.1]
+        # Drop words the decoder repeated from the already committed tail
+        if self.new and self.committed_in_buffer \
+                and abs(self.new[0][0] - self.last_committed_time) < 1:
+            n = min(len(self.committed_in_buffer), len(self.new), 5)
+            for i in range(n, 0, -1):
+                committed = [_norm(w[2]) for w in self.committed_in_buffer[-i:]]
+                head = [_norm(w[2]) for w in self.new[:i]]
+                if committed == head:
+                    del self.new[:i]
+                    break
+
+    def flush(self) -> typing.List[Word]:
+        commit = []
+        while self.new and self.buffer \
+                and _norm(self.new[0][2]) == _norm(self.buffer[0][2]):
+            word = self.new.pop(0)
+            self.buffer.pop(0)
+            commit.append(word)
+            self.last_committed_time = word[1]
+        self.buffer = self.new
+        self.new = []
+        self.committed_in_buffer.extend(commit)
+        return commit
+
+    def pop_committed(self, until: float) -> None:
+        self.committed_in_buffer = [w for w in self.committed_in_buffer
+                                    if w[1] > until]
+
+    def complete(self) -> typing.List[Word]:
+        return self.buffer
+
+
+def join_words(words: typing.Iterable[Word]) -> str:
+    return ''.join(w[2] for w in words).strip()
+
+
+class StreamingSession:
+    """ Rolling buffer and hypothesis state of one client stream.
+
+    Args:
+        transcribe_words: coroutine function (audio, prompt) returning
+            word-timestamped hypotheses relative to the start of `audio`.
+    """
+
+    def __init__(self, transcribe_words: typing.Callable) -> None:
+        self.transcribe_words = transcribe_words
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.offset = 0.0
+        self.hypothesis = HypothesisBuffer()
+        self.committed = ''
+        self.pending = ''
+
+    def _trim(self, until: float) -> None:
+        cut = int((until - self.offset) * SAMPLE_RATE)
+        if cut > 0:
+            self.audio = self.audio[cut:]
+            self.offset = until
+            self.hypothesis.pop_committed(until)
+
+    async def feed(self, samples: np.ndarray, last: bool
+                   ) -> typing.Tuple[str, str, typing.List[str]]:
+        """ Add a chunk and re-decode.
+
+        Returns (newly committed text, partial hypothesis, finished
+        sentences ready for translation).
+        """
+        self.audio = np.concatenate([self.audio, samples.astype(np.float32)])
+        words = []
+        if len(self.audio):
+            words = await self.transcribe_words(
+                self.audio, self.committed[-PROMPT_CHARS:] or None)
+        self.hypothesis.insert(words, self.offset)
+        commit = self.hypothesis.flush()
+        overflow = len(self.audio) > MAX_BUFFER_SECONDS * SAMPLE_RATE
+        if last or overflow:
+            commit += self.hypothesis.complete()
+            self.hypothesis.buffer = []
+
+        # Word strings carry their own leading space where the language has one
+        raw = ''.join(w[2] for w in commit)
+        if commit:
+            self.committed += raw
+            self.pending += raw
+            self._trim(commit[-1][1])
+        if overflow:
+            self._trim(self.offset + len(self.audio) / SAMPLE_RATE
+                       - MAX_BUFFER_SECONDS / 2)
+
+        sentences = []
+        if self.pending.strip() and (last or SENTENCE_END.search(self.pending)):
+            sentences.append(self.pending.strip())
+            self.pending = ''
+        if last:
+            self.audio = np.zeros(0, dtype=np.float32)
+            self.offset = 0.0
+            self.committed = ''
+            self.hypothesis = HypothesisBuffer()
+        return raw.strip(), join_words(self.hypothesis.complete()), sentences
+
+
+def hypothesis_message(text: str, seq: int) -> str:
+    return json.dumps({'text': text, 'seq': seq, 'ts': time.time()},
+                      ensure_ascii=False)
@@ -0,0 +1,42 @@
+"""
+Per-utterance latency tracing.
+
+Every utterance carries a trace envelope in its wire frames: an id and the
+unix time at which it passed each stage of STAGES. The speaking client
+stamps capture and enqueue, the server dequeue through push, and each
+listening client reports play start back through TRACES_KEY. Consecutive
+stages are recorded as `stage.<a>_to_<b>` histograms and capture to play
+start as `stage.total`. Stages stamped on different machines compare
+different clocks.
+"""
+import time
+import typing
+import uuid
+
+from . import metrics
+
+STAGES = ('capture', 'enqueue', 'dequeue', 'asr', 'translate', 'tts',
+          'push', 'play')
+
+
+def new_trace(**stamps: float) -> dict:
+    return {'id': uuid.uuid4().hex[:16], **stamps}
+
+
+def stamp(trace: dict, stage: str, ts: typing.Optional[float] = None) -> dict:
+    trace[stage] = time.time() if ts is None else ts
+    return trace
+
+
+def observe(trace: dict, stages: typing.Sequence[str] = STAGES) -> None:
+    """ Record the time between consecutive stamped stages of `stages`. """
+    present = [s for s in stages if trace.get(s)]
+    for a, b in zip(present, present[1:]):
+        metrics.histogram(f'stage.{a}_to_{b}').observe(trace[b] - trace[a])
+
+
+def observe_playout(trace: dict) -> None:
+    """ Record the stages a listener reported after the server pushed. """
+    observe(trace, ('push', 'play'))
+    if trace.get('capture') and trace.get('play'):
+        metrics.histogram('stage.total').observe(trace['play'] - trace['capture'])
@@ -1,54 +1,270 @@
 # Use the Conversation API to send a text message to Anthropic Claude.
 
-import boto3
+import asyncio
+import hashlib
+import html
 import json
-from botocore.exceptions import ClientError
 import logging
+import re
+import time
+import typing
+import unicodedata
 
-# Create a Bedrock Runtime client in the AWS Region you want to use.
-client = boto3.client("bedrock-runtime", region_name="us-west-2")
+from . import metrics
+from .cache import LRUCache, RedisCache
+from .config import (TRANSLATE_BACKEND, TRANSLATE_CACHE_REDIS,
+                     TRANSLATE_CACHE_REDIS_SIZE, TRANSLATE_CACHE_SIZE,
+                     TRANSLATE_CACHE_TTL, TRANSLATE_CONCURRENCY,
+                     TRANSLATE_MAX_BATCH, TRANSLATE_MODEL_ID,
+                     TRANSLATE_REGION, TRANSLATE_STUB_LATENCY)
+from .executors import run_in
+from .redis_pool import get_redis
 
-# Set the model ID, e.g., Claude 3 Haiku.
-model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
+LANGS = ('zh', 'en')
+LANGUAGE_NAMES = {'zh': 'Chinese', 'en': 'English'}
 
-system_message = """Fix only the grammar errors and do not delete anything in the following text in <text></text> from auto speech recognition and translate it into Chinese and English using the following output format:
-{
-  "zh": "Translation in Chinese",
-  "en": "Translation in English"
-}
+system_message = """Fix only the grammar errors and do not delete anything in every <item></item> of the following <items></items> from auto speech recognition and translate each item into {languages}. Reply with one JSON object keyed by item id using the following output format:
+{{
+{example}
+}}
 """
 
 
-def translate(text):
-    conversation = [
-        {
-            "role": "user",
-            "content": [{"text": f'<text>{text}</text>'}],
-        }
-    ]
-
-    system = [
-        {
-            'text': system_message,
-        },
-    ]
-    try:
-        response = client.converse(
-            system=system,
-            modelId=model_id,
-            messages=conversation,
+class BedrockBackend:
+    """ Amazon Bedrock Converse API. The call is blocking and is run on the
+    shared io executor by `Translator`.
+    """
+
+    def __init__(self,
+                 model_id: str = TRANSLATE_MODEL_ID,
+                 region_name: str = TRANSLATE_REGION) -> None:
+        import boto3
+
+        # Create a Bedrock Runtime client in the AWS Region you want to use.
+        self.client = boto3.client("bedrock-runtime", region_name=region_name)
+        self.model_id = model_id
+
+    def converse(self, system: str, text: str) -> str:
+        response = self.client.converse(
+            system=[{'text': system}],
+            modelId=self.model_id,
+            messages=[{"role": "user", "content": [{"text": text}]}],
             inferenceConfig={"maxTokens": 4096, "temperature": 0.5, "topP": 0.9},
         )
-        response_text = response["output"]["message"]["content"][0]["text"]
-        logging.info(response_text)
-        response_text = response_text[response_text.find('{'):]
-        translated_dict = json.loads(response_text)
-        logging.info(translated_dict)
-        return translated_dict
-    except (ClientError, Exception) as e:
-        print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
-        return {"zh": "", "en": ""}
+        return response["output"]["message"]["content"][0]["text"]
+
+
+class StubBackend:
+    """ Local stand-in for the LLM. It answers the multi-item prompt with a
+    JSON object that echoes every item back for every requested language,
+    after an optional fake latency, so the batching and parsing code can be
+    exercised without AWS credentials.
+    """
+
+    def __init__(self, latency: float = TRANSLATE_STUB_LATENCY) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    def converse(self, system: str, text: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        langs = re.findall(r'"(\w+)": "Translation in', system)
+        items = re.findall(r'<item id="(\d+)">(.*?)</item>', text, re.S)
+        return json.dumps({i: {lang: html.unescape(t) for lang in langs}
+                           for i, t in items}, ensure_ascii=False)
+
+
+def get_backend(name: str = TRANSLATE_BACKEND):
+    if name == 'stub':
+        return StubBackend()
+    return BedrockBackend()
+
+
+def build_prompt(texts: typing.List[str],
+                 langs: typing.Sequence[str]) -> typing.Tuple[str, str]:
+    names = [LANGUAGE_NAMES.get(lang, lang) for lang in langs]
+    pairs = ', '.join(f'"{lang}": "Translation in {name}"'
+                      for lang, name in zip(langs, names))
+    example = ',\n'.join(f'  "{i}": {{{pairs}}}' for i in range(len(texts)))
+    system = system_message.format(languages=' and '.join(names),
+                                   example=example)
+    items = ''.join(f'<item id="{i}">{html.escape(t, quote=False)}</item>'
+                    for i, t in enumerate(texts))
+    return system, f'<items>{items}</items>'
+
+
+def parse_response(response_text: str, n: int,
+                   langs: typing.Sequence[str]) -> typing.List[typing.Dict[str, str]]:
+    response_text = response_text[response_text.find('{'):response_text.rfind('}') + 1]
+    translated = json.loads(response_text)
+    results = []
+    for i in range(n):
+        item = translated.get(str(i)) or {}
+        results.append({lang: item.get(lang, '') for lang in langs})
+    return results
+
+
+def normalize(text: str) -> str:
+    """ Cache key form of ASR text: case, punctuation and spacing differences
+    such as "Yes." / "yes" map to the same entry.
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = ''.join(' ' if unicodedata.category(c).startswith('P') else c
+                   for c in text)
+    return ' '.join(text.split())
+
+
+class TranslationCache:
+    """ Translations keyed by normalized source text and target-language
+    set. Lookups go to the in-process LRU first and then to the optional
+    shared Redis tier.
+
+    Args:
+        max_items (int, optional): in-process LRU size.
+        redis (optional): asyncio redis client enabling the shared tier.
+        ttl (int, optional): Redis entry lifetime in seconds.
+        redis_max_items (int, optional): Redis tier size limit.
+    """
+
+    def __init__(self,
+                 max_items: int = TRANSLATE_CACHE_SIZE,
+                 redis=None,
+                 ttl: int = TRANSLATE_CACHE_TTL,
+                 redis_max_items: int = TRANSLATE_CACHE_REDIS_SIZE) -> None:
+        self.memory = LRUCache(max_items=max_items)
+        self.shared = RedisCache(redis, 'STS:CACHE:TRANSLATE', ttl,
+                                 redis_max_items) if redis is not None else None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, langs: typing.Sequence[str]) -> str:
+        digest = hashlib.sha1(normalize(text).encode('utf-8')).hexdigest()
+        return f'{",".join(sorted(langs))}:{digest}'
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {'hits': self.hits, 'shared_hits': self.shared_hits,
+                'misses': self.misses, 'size': len(self.memory)}
+
+    async def get(self, text: str,
+                  langs: typing.Sequence[str]) -> typing.Optional[typing.Dict[str, str]]:
+        key = self.key(text, langs)
+        result = self.memory.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        if self.shared is not None:
+            try:
+                raw = await self.shared.get(key)
+            except Exception as e:
+                logging.warning(f"Translation cache read failed: {e}")
+                raw = None
+            if raw is not None:
+                result = json.loads(raw)
+                self.memory.set(key, result)
+                self.shared_hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, langs: typing.Sequence[str],
+                  result: typing.Dict[str, str]) -> None:
+        if not any(result.values()):
+            # Failed requests come back empty, do not pin them
+            return
+        key = self.key(text, langs)
+        self.memory.set(key, result)
+        if self.shared is not None:
+            try:
+                await self.shared.set(
+                    key, json.dumps(result, ensure_ascii=False))
+            except Exception as e:
+                logging.warning(f"Translation cache write failed: {e}")
+
+
+class Translator:
+    """ Asynchronous translation stage.
+
+    Requests are queued and never block the event loop. Whenever requests
+    pile up behind the concurrency limit, everything waiting for the same
+    target languages is sent as one multi-item LLM request and the JSON
+    reply is split back per utterance.
+
+    Args:
+        backend: object with a blocking `converse(system, text) -> str`.
+        max_batch (int, optional): most utterances in one LLM request.
+        concurrency (int, optional): most LLM requests in flight.
+        cache (TranslationCache, optional): checked before any remote call.
+    """
+
+    def __init__(self,
+                 backend=None,
+                 max_batch: int = TRANSLATE_MAX_BATCH,
+                 concurrency: int = TRANSLATE_CONCURRENCY,
+                 cache: typing.Optional[TranslationCache] = None) -> None:
+        self.backend = backend or get_backend()
+        self.cache = cache or TranslationCache(
+            redis=get_redis() if TRANSLATE_CACHE_REDIS else None)
+        metrics.register_gauge('translate.cache', self.cache.stats)
+        self.max_batch = max(1, max_batch)
+        self.concurrency = concurrency
+        self._pending: typing.Optional[asyncio.Queue] = None
+        self._batcher: typing.Optional[asyncio.Task] = None
+        self._slots: typing.Optional[asyncio.Semaphore] = None
+        self._inflight: typing.Set[asyncio.Task] = set()
+
+    async def translate(self, text: str,
+                        langs: typing.Sequence[str] = LANGS) -> typing.Dict[str, str]:
+        cached = await self.cache.get(text, langs)
+        if cached is not None:
+            return dict(cached)
+        result = await self._submit(text, langs)
+        await self.cache.set(text, langs, result)
+        return result
+
+    async def _submit(self, text: str,
+                      langs: typing.Sequence[str]) -> typing.Dict[str, str]:
+        if self._batcher is None:
+            self._pending = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._batcher = asyncio.create_task(self._batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        self._pending.put_nowait((text, tuple(langs), future))
+        return await future
+
+    async def _batch_loop(self) -> None:
+        while True:
+            first = await self._pending.get()
+            await self._slots.acquire()
+            batch, rest = [first], []
+            while not self._pending.empty() and len(batch) < self.max_batch:
+                item = self._pending.get_nowait()
+                (batch if item[1] == first[1] else rest).append(item)
+            for item in rest:
+                self._pending.put_nowait(item)
+            task = asyncio.create_task(self._run(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, batch: list) -> None:
+        texts = [text for text, _, _ in batch]
+        langs = batch[0][1]
+        try:
+            system, user = build_prompt(texts, langs)
+            response_text = await run_in('io', self.backend.converse,
+                                         system, user)
+            logging.info(response_text)
+            results = parse_response(response_text, len(texts), langs)
+        except Exception as e:
+            logging.error(f"ERROR: Can't translate {len(texts)} items. Reason: {e}")
+            results = [{lang: '' for lang in langs} for _ in texts]
+        finally:
+            self._slots.release()
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
 
 
 if __name__ == '__main__':
-    translate("亚马逊云科技AI技术展示")
+    print(asyncio.run(Translator().translate("亚马逊云科技AI技术展示")))
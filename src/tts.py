@@ -1,33 +1,291 @@
-import ChatTTS
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import typing
+
 import soundfile
-import torch
 import numpy as np
 import logging
 
+from . import codec, metrics
+from .audio import TTS_SAMPLE_RATE
+from .batching import MicroBatcher
+from .cache import DiskCache, LRUCache, RedisCache
+from .config import (COMPILE_CACHE_DIR, STARTUP_WARMUP, TTS_BACKEND,
+                     TTS_BATCH_WINDOW_MS, TTS_CACHE_BYTES, TTS_CACHE_DIR,
+                     TTS_CACHE_DISK_BYTES, TTS_CACHE_REDIS_SIZE,
+                     TTS_CACHE_TIER, TTS_CACHE_TTL, TTS_COMPILE,
+                     TTS_MAX_BATCH, TTS_MIN_CHUNK_CHARS, TTS_STREAM,
+                     TTS_STUB_LATENCY, TTS_WARMUP_TEXT)
+from .executors import run_in
+from .redis_pool import get_redis
+
 logging.basicConfig(level=logging.INFO)
 
-chat = ChatTTS.Chat()
-chat.load_models(compile=True) # Set to True for better performance
+SPEAKER_SEED = 222
+
 
-def deterministic(seed=222):
+def deterministic(seed=SPEAKER_SEED):
+    import torch
     torch.manual_seed(seed)
     np.random.seed(seed)
     torch.cuda.manual_seed(seed)
     torch.backends.cudnn.deterministic = True
     torch.backends.cudnn.benchmark = False
-    
-deterministic(222)
-rnd_spk_emb = chat.sample_random_speaker(222)
-params_infer_code = {
-    "spk_emb": rnd_spk_emb,
-}
-
-    
+
+
+def compile_cache(directory: str = COMPILE_CACHE_DIR) -> None:
+    """ Keep torch.compile's generated kernels and FX graphs in `directory`
+    instead of a temp dir, so that a restart reuses them rather than
+    compiling again. Takes effect only before torch compiles anything.
+    """
+    if not directory:
+        return
+    directory = os.path.abspath(directory)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(directory, 'inductor'))
+    os.environ.setdefault('TRITON_CACHE_DIR', os.path.join(directory, 'triton'))
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+
+
+class ChatTTSBackend:
+    """ ChatTTS with the fixed speaker sampled from `seed`. Models are
+    loaded when the backend is created, compiled with torch.compile if
+    `compile` is set.
+    """
+
+    def __init__(self, seed: int = SPEAKER_SEED,
+                 compile: bool = TTS_COMPILE) -> None:
+        compile_cache()
+        import ChatTTS
+
+        self.chat = ChatTTS.Chat()
+        self.chat.load_models(compile=compile)
+        deterministic(seed)
+        rnd_spk_emb = self.chat.sample_random_speaker(seed)
+        self.params_infer_code = {
+            "spk_emb": rnd_spk_emb,
+        }
+
+    def infer(self, texts: typing.List[str]) -> typing.List[np.ndarray]:
+        wavs = self.chat.infer(texts, use_decoder=True,
+                               params_infer_code=self.params_infer_code)
+        return [wav[0] for wav in wavs]
+
+
+class StubBackend:
+    """ Local stand-in for ChatTTS. Returns silence roughly as long as the
+    text would take to speak, after an optional fake latency per batch, so
+    the pipeline can be benchmarked without a GPU.
+    """
+
+    def __init__(self, latency: float = TTS_STUB_LATENCY,
+                 seconds_per_char: float = 0.06) -> None:
+        self.latency = latency
+        self.seconds_per_char = seconds_per_char
+        self.calls = 0
+
+    def infer(self, texts: typing.List[str]) -> typing.List[np.ndarray]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [np.zeros(int(len(t) * self.seconds_per_char * TTS_SAMPLE_RATE),
+                         dtype=np.float32) for t in texts]
+
+
+def get_backend(name: str = TTS_BACKEND):
+    if name == 'stub':
+        return StubBackend()
+    return ChatTTSBackend()
+
+
+# Created by `load`, on the tts executor thread at server startup or by the
+# first synthesis otherwise
+backend = None
+# Everything besides the text that changes the synthesized audio
+CACHE_PARAMS = {"use_decoder": True, "sample_rate": TTS_SAMPLE_RATE,
+                "backend": TTS_BACKEND}
+
+
+def load(warmup: bool = 'tts' in STARTUP_WARMUP):
+    """ Create the configured backend once and, with `warmup`, synthesize
+    TTS_WARMUP_TEXT so that the first request does not pay for lazy
+    initialisation. Returns the backend.
+    """
+    global backend
+    if backend is None:
+        start = time.time()
+        backend = get_backend()
+        logging.info(f'TTS backend {TTS_BACKEND} loaded in {time.time() - start:.1f}s')
+        if warmup and TTS_WARMUP_TEXT:
+            start = time.time()
+            backend.infer([TTS_WARMUP_TEXT])
+            logging.info(f'TTS warm-up took {time.time() - start:.1f}s')
+    return backend
+
+
 def tts(text):
     logging.info(f'Doing tts to {text}')
-    return chat.infer([text], use_decoder=True, params_infer_code=params_infer_code)[0][0]
+    return load(warmup=False).infer([text])[0]
+
+
+# Sentence ends, then clause breaks. ASCII marks need trailing whitespace so
+# that "3.5" or "e.g." are not split.
+SENTENCE_END = re.compile(r'(?<=[。！？；…])|(?<=[.!?;])\s+')
+CLAUSE_END = re.compile(r'(?<=[，、：])|(?<=[,:])\s+')
+
+
+def split_sentences(text: str, min_chars: int = TTS_MIN_CHUNK_CHARS,
+                    stream: bool = TTS_STREAM) -> typing.List[str]:
+    """ Split text into pieces that can be synthesized and played one after
+    another. Sentences are split first, long sentences again at clause
+    breaks, and pieces shorter than `min_chars` are merged into the next.
+    Empty or whitespace-only text has no pieces.
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if not stream:
+        return [text]
+    parts = []
+    for sentence in SENTENCE_END.split(text):
+        if len(sentence) > 2 * min_chars:
+            parts.extend(CLAUSE_END.split(sentence))
+        else:
+            parts.append(sentence)
+
+    pieces, current = [], ''
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        current = f'{current} {part}' if current and part.isascii() else current + part
+        if len(current) >= min_chars:
+            pieces.append(current)
+            current = ''
+    if current:
+        if pieces:
+            pieces[-1] = f'{pieces[-1]} {current}' if current.isascii() \
+                else pieces[-1] + current
+        else:
+            pieces.append(current)
+    return pieces
+
+
+def tts_batch(texts: typing.List[str]) -> list:
+    """ Synthesize several texts in one forward pass. """
+    logging.info(f'Doing tts to {texts}')
+    return load(warmup=False).infer(texts)
+
+
+class TTSWorker:
+    """ Batched speech synthesis off the event loop.
+
+    Texts from every language and utterance are collected for up to
+    `window_ms` and synthesized with a single `backend.infer` call on the tts
+    executor thread. One batch runs at a time; texts arriving meanwhile
+    join the next one, so under load zh and en share a forward pass.
+    """
+
+    def __init__(self,
+                 window_ms: float = TTS_BATCH_WINDOW_MS,
+                 max_batch: int = TTS_MAX_BATCH) -> None:
+        self._batcher = MicroBatcher('tts', self._run_batch, window_ms,
+                                     max_batch, concurrency=1)
+
+    async def synthesize(self, text: str, audio_codec: int) -> bytes:
+        return await self._batcher.submit((text, audio_codec))
+
+    async def _run_batch(self, items: list) -> typing.List[bytes]:
+        wavs = await run_in('tts', tts_batch, [text for text, _ in items])
+        # Encoding, e.g. Opus at tens of ms per second of audio, would hold
+        # up the next batch on the single tts thread
+        return await asyncio.gather(*(
+            run_in('codec', codec.encode, wav, TTS_SAMPLE_RATE, c)
+            for wav, (_, c) in zip(wavs, items)))
+
+
+class TTSCache:
+    """ Encoded TTS audio keyed by (text, language, codec, speaker seed,
+    params).
+    The speaker embedding is fixed by `deterministic`, so the same text
+    always synthesizes to the same audio and repeated phrases can skip
+    `backend.infer` entirely.
+
+    The in-process tier is an LRU under a byte budget. A second tier, set
+    by `tier`, is either "disk" (LRU under a byte budget in `directory`),
+    "redis" (shared between servers, TTL and entry limit) or "none".
+    """
+
+    def __init__(self,
+                 max_bytes: int = TTS_CACHE_BYTES,
+                 tier: str = TTS_CACHE_TIER,
+                 directory: str = TTS_CACHE_DIR,
+                 disk_bytes: int = TTS_CACHE_DISK_BYTES,
+                 redis_max_items: int = TTS_CACHE_REDIS_SIZE,
+                 ttl: int = TTS_CACHE_TTL) -> None:
+        self.memory = LRUCache(max_bytes=max_bytes)
+        self.disk = DiskCache(directory, disk_bytes) if tier == 'disk' else None
+        self.shared = RedisCache(get_redis(), 'STS:CACHE:TTS', ttl,
+                                 redis_max_items) if tier == 'redis' else None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, lang: str, audio_codec: int) -> str:
+        raw = json.dumps([text.strip(), lang, audio_codec, SPEAKER_SEED,
+                          CACHE_PARAMS],
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {'hits': self.hits, 'shared_hits': self.shared_hits,
+                'misses': self.misses, 'bytes': self.memory.bytes}
+
+    async def _get_shared(self, key: str) -> typing.Optional[bytes]:
+        if self.disk is not None:
+            return await run_in('io', self.disk.get, key)
+        if self.shared is not None:
+            return await self.shared.get(key)
+        return None
+
+    async def get(self, text: str, lang: str,
+                  audio_codec: int) -> typing.Optional[bytes]:
+        key = self.key(text, lang, audio_codec)
+        wav = self.memory.get(key)
+        if wav is not None:
+            self.hits += 1
+            return wav
+        try:
+            wav = await self._get_shared(key)
+        except Exception as e:
+            logging.warning(f"TTS cache read failed: {e}")
+            wav = None
+        if wav is not None:
+            self.memory.set(key, wav)
+            self.shared_hits += 1
+            return wav
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, lang: str, audio_codec: int,
+                  wav: bytes) -> None:
+        key = self.key(text, lang, audio_codec)
+        self.memory.set(key, wav)
+        try:
+            if self.disk is not None:
+                await run_in('io', self.disk.set, key, wav)
+            elif self.shared is not None:
+                await self.shared.set(key, wav)
+        except Exception as e:
+            logging.warning(f"TTS cache write failed: {e}")
+
 
-tts("初始化一下")
+tts_cache = TTSCache()
+tts_worker = TTSWorker()
+metrics.register_gauge('tts.cache', tts_cache.stats)
 
 if __name__ == '__main__':
     wav = tts("测试中文和English")
@@ -0,0 +1,167 @@
+"""
+Voice activity segmentation shared by the clients and the local scripts.
+
+A `VadSegmenter` takes fixed-size 16-bit mono PCM frames from any source,
+a PyAudio input stream or a WAV file alike, and returns an utterance each
+time the speaker stops. Speech starts once more than `ratio` of the last
+`window` frames are voiced and ends once more than `ratio` of the frames
+since then are unvoiced. Both counts are kept as running counters over a
+fixed window, and the audio goes into a preallocated ring buffer, so every
+frame costs O(1) no matter how long the utterance is.
+"""
+import typing
+import wave
+from io import BytesIO
+
+from .audio import SAMPLE_RATE
+
+FRAME_DURATION = 30  # milliseconds, one of the 10/20/30 ms webrtcvad accepts
+
+
+class VadSegmenter:
+    """ Split a stream of PCM16 frames into utterances.
+
+    Args:
+        mode (int, optional): webrtcvad aggressiveness, 0 to 3.
+        sample_rate (int, optional): sample rate of the frames.
+        frame_duration (int, optional): frame length in milliseconds.
+        window (int, optional): frames the start and stop decisions look at.
+        ratio (float, optional): share of the window that has to agree.
+        max_seconds (float, optional): longest utterance; speech that goes
+            on longer is cut into utterances of this length.
+        is_speech (callable, optional): frame -> bool, replaces webrtcvad.
+    """
+
+    def __init__(self,
+                 mode: int = 1,
+                 sample_rate: int = SAMPLE_RATE,
+                 frame_duration: int = FRAME_DURATION,
+                 window: int = 30,
+                 ratio: float = 0.5,
+                 max_seconds: float = 30,
+                 is_speech: typing.Optional[typing.Callable[[bytes], bool]] = None
+                 ) -> None:
+        if is_speech is None:
+            import webrtcvad
+            vad = webrtcvad.Vad(mode)
+            is_speech = lambda frame: vad.is_speech(frame, sample_rate)  # noqa: E731
+        self.is_speech = is_speech
+        self.sample_rate = sample_rate
+        self.frame_size = sample_rate * frame_duration // 1000
+        self.frame_bytes = self.frame_size * 2
+        self.window = window
+        self.threshold = ratio * window
+
+        self._flags = [False] * window
+        self._flag_pos = 0
+        self._filled = 0
+        self._voiced = 0
+
+        self._capacity = max(window, int(max_seconds * 1000 / frame_duration))
+        self._ring = bytearray(self._capacity * self.frame_bytes)
+        self._head = 0  # next frame slot to write
+        self._frames = 0  # frames currently held, at most _capacity
+        self.triggered = False
+
+    def _reset_window(self) -> None:
+        self._filled = 0
+        self._voiced = 0
+        self._flag_pos = 0
+
+    def _take(self) -> bytes:
+        """ Held frames in recording order, emptying the buffer. """
+        first = (self._head - self._frames) % self._capacity
+        start, end = first * self.frame_bytes, self._head * self.frame_bytes
+        if self._frames and end <= start:
+            pcm = bytes(self._ring[start:]) + bytes(self._ring[:end])
+        else:
+            pcm = bytes(self._ring[start:end])
+        self._frames = 0
+        return pcm
+
+    def push(self, frame: bytes) -> typing.Optional[bytes]:
+        """ Add one frame. Returns the utterance PCM when it ends here. """
+        if len(frame) != self.frame_bytes:
+            raise ValueError(f'Expected {self.frame_bytes} byte frames, '
+                             f'got {len(frame)}')
+        speech = bool(self.is_speech(frame))
+        # Running voiced count over the last `window` frames
+        pos = self._flag_pos
+        if self._filled == self.window:
+            self._voiced -= self._flags[pos]
+        else:
+            self._filled += 1
+        self._flags[pos] = speech
+        self._voiced += speech
+        self._flag_pos = pos + 1 if pos + 1 < self.window else 0
+
+        start = self._head * self.frame_bytes
+        self._ring[start:start + self.frame_bytes] = frame
+        self._head = self._head + 1 if self._head + 1 < self._capacity else 0
+        if self._frames < self._capacity:
+            self._frames += 1
+
+        if not self.triggered:
+            # Keep only one window of audio before speech starts
+            if self._frames > self.window:
+                self._frames = self.window
+            if self._voiced > self.threshold:
+                self.triggered = True
+                self._reset_window()
+        elif self._filled - self._voiced > self.threshold:
+            self.triggered = False
+            self._reset_window()
+            return self._take()
+        elif self._frames == self._capacity:
+            # Forced cut, the next frame would overwrite the utterance start
+            return self._take()
+        return None
+
+    def flush(self) -> typing.Optional[bytes]:
+        """ Audio of an utterance still in progress, e.g. at end of file. """
+        if not self.triggered:
+            return None
+        self.triggered = False
+        self._reset_window()
+        return self._take()
+
+    def segments(self, frames: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+        """ Utterances of a whole frame source, flushed at its end. """
+        for frame in frames:
+            pcm = self.push(frame)
+            if pcm is not None:
+                yield pcm
+        pcm = self.flush()
+        if pcm is not None:
+            yield pcm
+
+
+def stream_frames(stream, frame_size: int) -> typing.Iterator[bytes]:
+    """ Frames read from a PyAudio input stream, forever. """
+    while True:
+        yield stream.read(frame_size)
+
+
+def wav_frames(source, frame_size: int) -> typing.Iterator[bytes]:
+    """ Frames of a 16-bit mono WAV file path or file object. A trailing
+    partial frame is dropped.
+    """
+    with wave.open(source, 'rb') as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+            raise ValueError('Expected 16-bit mono WAV')
+        while True:
+            frame = wf.readframes(frame_size)
+            if len(frame) < frame_size * 2:
+                return
+            yield frame
+
+
+def to_wav(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """ Wrap 16-bit mono PCM in an in-memory WAV container. """
+    buf = BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buf.getvalue()
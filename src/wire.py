@@ -0,0 +1,100 @@
+"""
+Framing for audio pushed through Redis in either direction. A frame is a
+fixed header followed by the encoded payload:
+
+    magic        4s  b'STSF'
+    version      B
+    flags        B   FLAG_LAST marks the final chunk of an utterance,
+                     FLAG_STREAM a fixed-size chunk of a streaming session,
+                     FLAG_TRACE a trace envelope follows the header
+    codec        B   see `codec.CODECS`
+    (pad)        x
+    sample_rate  I
+    seq          I   chunk sequence number, increasing per sender and stream
+    ts           d   unix time the chunk was produced
+
+With FLAG_TRACE the header is followed by a little-endian uint16 length and
+that many bytes of JSON: the utterance trace id and its stage timestamps,
+see `tracing`.
+
+Blobs without the magic are treated as legacy single-chunk WAV payloads.
+"""
+import json
+import struct
+import time
+import typing
+
+from .codec import WAV, decode as decode_payload
+
+MAGIC = b'STSF'
+VERSION = 2
+HEADER = struct.Struct('<4sBBBxIId')
+FLAG_LAST = 0x01
+FLAG_STREAM = 0x02
+FLAG_TRACE = 0x04
+TRACE_LENGTH = struct.Struct('<H')
+
+
+class Frame(typing.NamedTuple):
+    seq: int
+    last: bool
+    ts: float
+    payload: bytes
+    codec: int = WAV
+    sample_rate: int = 0
+    stream: bool = False
+    trace: typing.Optional[dict] = None
+
+
+def pack(payload: bytes, seq: int = 0, last: bool = True,
+         ts: typing.Optional[float] = None, codec: int = WAV,
+         sample_rate: int = 0, stream: bool = False,
+         trace: typing.Optional[dict] = None) -> bytes:
+    flags = (FLAG_LAST if last else 0) | (FLAG_STREAM if stream else 0) \
+        | (FLAG_TRACE if trace else 0)
+    header = HEADER.pack(MAGIC, VERSION, flags, codec, sample_rate,
+                         seq & 0xFFFFFFFF, time.time() if ts is None else ts)
+    if trace:
+        raw = json.dumps(trace, separators=(',', ':')).encode('utf-8')
+        header += TRACE_LENGTH.pack(len(raw)) + raw
+    return header + payload
+
+
+def unpack(blob: bytes) -> Frame:
+    if blob[:4] != MAGIC:
+        return Frame(0, True, 0.0, blob)
+    _, _, flags, codec, sample_rate, seq, ts = HEADER.unpack_from(blob)
+    offset, trace = HEADER.size, None
+    if flags & FLAG_TRACE:
+        length, = TRACE_LENGTH.unpack_from(blob, offset)
+        offset += TRACE_LENGTH.size
+        trace = json.loads(blob[offset:offset + length])
+        offset += length
+    return Frame(seq, bool(flags & FLAG_LAST), ts, blob[offset:],
+                 codec, sample_rate, bool(flags & FLAG_STREAM), trace)
+
+
+def peek_seq(blob: bytes) -> typing.Optional[int]:
+    """ Sequence number from the header alone, None for legacy blobs. """
+    if blob[:4] != MAGIC:
+        return None
+    return HEADER.unpack_from(blob)[5]
+
+
+def restamp(blob: bytes, stage: str, ts: typing.Optional[float] = None) -> bytes:
+    """ Copy of a traced frame with one more stage timestamp. """
+    frame = unpack(blob)
+    if frame.trace is None:
+        return blob
+    frame.trace[stage] = time.time() if ts is None else ts
+    return pack(frame.payload, frame.seq, frame.last, frame.ts, frame.codec,
+                frame.sample_rate, frame.stream, frame.trace)
+
+
+def decode(blob: bytes, sample_rate: int) -> typing.Tuple[Frame, typing.Any]:
+    """ Unpack a frame and decode its audio to float32. Legacy WAV blobs
+    are decoded at `sample_rate`.
+    """
+    frame = unpack(blob)
+    return frame, decode_payload(frame.payload, frame.codec,
+                                 frame.sample_rate or sample_rate)
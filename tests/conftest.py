@@ -0,0 +1,9 @@
+"""
+Settings are read from the environment at import time; the tests only
+use in-process stand-ins, so no Redis server or model is needed.
+"""
+import os
+
+os.environ.setdefault('REDIS_SERVER', 'redis://localhost')
+os.environ.setdefault('TRANSLATE_BACKEND', 'stub')
+os.environ.setdefault('TTS_BACKEND', 'stub')
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from src import codec
+from src.audio import decode_pcm, encode_wav
+
+RATE = 16000
+
+
+def tone(seconds=0.5, freq=440.0):
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (0.5 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+@pytest.mark.parametrize('name', ['pcm', 'wav', 'flac'])
+def test_lossless_round_trip(name):
+    if name not in codec.available():
+        pytest.skip(f'{name} not supported by this libsndfile')
+    samples = tone()
+    payload = codec.encode(samples, RATE, codec.CODECS[name])
+    decoded = codec.decode(payload, codec.CODECS[name], RATE)
+    assert decoded.dtype == np.float32
+    assert len(decoded) == len(samples)
+    np.testing.assert_allclose(decoded, samples, atol=1e-4)
+
+
+def test_int16_input_is_encoded_as_is():
+    pcm = np.array([0, 1, -1, 32767, -32768], dtype=np.int16)
+    assert codec.encode(pcm, RATE, codec.PCM) == pcm.astype('<i2').tobytes()
+
+
+def test_opus_round_trip_keeps_the_signal():
+    if 'opus' not in codec.available():
+        pytest.skip('opus not supported by this libsndfile')
+    samples = tone(1.0)
+    payload = codec.encode(samples, RATE, codec.OPUS)
+    decoded = codec.decode(payload, codec.OPUS, RATE)
+    assert len(payload) < len(codec.encode(samples, RATE, codec.PCM)) / 4
+    assert abs(len(decoded) - len(samples)) < RATE // 10
+    rms = float(np.sqrt(np.mean(decoded ** 2)))
+    assert rms == pytest.approx(0.5 / np.sqrt(2), rel=0.2)
+
+
+def test_flac_is_smaller_than_pcm():
+    if 'flac' not in codec.available():
+        pytest.skip('flac not supported by this libsndfile')
+    samples = tone()
+    assert len(codec.encode(samples, RATE, codec.FLAC)) < \
+        len(codec.encode(samples, RATE, codec.PCM))
+
+
+def test_unknown_codec_raises():
+    with pytest.raises(ValueError):
+        codec.encode(tone(), RATE, 99)
+    with pytest.raises(ValueError):
+        codec.decode(b'', 99, RATE)
+
+
+def test_negotiate_picks_first_preference_every_receiver_supports():
+    prefs = ['opus', 'flac', 'wav', 'pcm']
+    assert codec.negotiate(prefs, [['wav', 'pcm'], ['wav', 'flac', 'pcm']]) == 'wav'
+    assert codec.negotiate(prefs, [['pcm']]) == 'pcm'
+    assert codec.negotiate(['flac'], [['wav']]) == 'pcm'
+    assert codec.negotiate(['mp3', 'wav'], [['mp3', 'wav']]) == 'wav'
+
+
+def test_decode_pcm_headerless_and_wav_agree():
+    samples = tone(0.1)
+    wav = encode_wav(samples, RATE)
+    raw = codec.encode(samples, RATE, codec.PCM)
+    np.testing.assert_array_equal(decode_pcm(wav, RATE),
+                                  decode_pcm(raw, RATE, headerless=True))
@@ -0,0 +1,110 @@
+import asyncio
+
+import fakeredis
+
+from src import metrics, protocol, wire
+from src.ingest import AudioIngest, SharedAck, UplinkGaps
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+async def take(ingest, n):
+    items = []
+    async for item in ingest:
+        items.append(item[:2])
+        if len(items) == n:
+            return items
+
+
+async def push(redis, client_uuid, *seqs):
+    async with redis.pipeline(transaction=False) as pipe:
+        protocol.push_audio(pipe, client_uuid,
+                            [wire.pack(b'%d' % s, seq=s) for s in seqs])
+        await pipe.execute()
+
+
+def payloads(items):
+    return [(u, wire.unpack(blob).payload) for u, blob in items]
+
+
+def test_audio_of_registered_clients_is_yielded():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        await protocol.register_client(redis, 'a')
+        await push(redis, 'a', 0, 1)
+        ingest = AudioIngest(redis, timeout=1)
+        items = await take(ingest, 2)
+        return ingest, items
+
+    ingest, items = run(scenario())
+    assert payloads(items) == [('a', b'0'), ('a', b'1')]
+    assert ingest.uuids == ['a']
+
+
+def test_registration_events_update_the_key_set():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        await protocol.register_client(redis, 'a')
+        ingest = AudioIngest(redis, timeout=1)
+        await protocol.register_client(redis, 'b')
+        await protocol.deregister_client(redis, 'a')
+        await push(redis, 'b', 0)
+        items = await take(ingest, 1)
+        return ingest, items
+
+    ingest, items = run(scenario())
+    assert payloads(items) == [('b', b'0')]
+    assert ingest.uuids == ['b']
+
+
+def test_busy_client_does_not_starve_the_others():
+    async def scenario():
+        redis = fakeredis.aioredis.FakeRedis()
+        for client_uuid in 'abc':
+            await protocol.register_client(redis, client_uuid)
+        await push(redis, 'a', 0, 1, 2)
+        await push(redis, 'b', 0)
+        await push(redis, 'c', 0)
+        return await take(AudioIngest(redis, timeout=1), 5)
+
+    items = run(scenario())
+    assert [u for u, _ in items] == ['a', 'b', 'c', 'a', 'a']
+
+
+def test_sequence_gaps_count_as_shed_audio():
+    gaps = UplinkGaps()
+    before = metrics.COUNTERS['shed.audio.queue']
+    assert [gaps.observe('a', wire.pack(b'', seq=s)) for s in (0, 1, 4, 5)] \
+        == [0, 0, 2, 0]
+    assert gaps.observe('b', wire.pack(b'', seq=9)) == 0
+    assert metrics.COUNTERS['shed.audio.queue'] - before == 2
+
+
+def test_restarts_and_legacy_blobs_are_not_gaps():
+    gaps = UplinkGaps()
+    gaps.observe('a', wire.pack(b'', seq=7))
+    # A restarted client counts from zero again
+    assert gaps.observe('a', wire.pack(b'', seq=0)) == 0
+    assert gaps.observe('a', b'RIFF legacy wav') == 0
+    gaps.forget('a')
+    assert gaps.observe('a', wire.pack(b'', seq=5)) == 0
+
+
+def test_shared_ack_waits_for_every_holder():
+    acks = []
+
+    async def ack():
+        acks.append(True)
+
+    async def scenario():
+        shared = SharedAck(ack)
+        first, second = shared.hold(), shared.hold()
+        await shared.release()
+        await first()
+        assert acks == []
+        await second()
+
+    run(scenario())
+    assert acks == [True]
@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+from src import playback
+from src.playback import JitterBuffer, Player
+
+
+def chunk(value, n=4):
+    return np.full(n, value, dtype=np.float32)
+
+
+def test_chunks_wait_for_the_jitter_then_play_in_order():
+    buffer = JitterBuffer(jitter=0.1, max_gap=1.0)
+    buffer.put(2, chunk(3), ts=0.0, now=0.0)
+    buffer.put(0, chunk(1), ts=0.0, now=0.01)
+    buffer.put(1, chunk(2), ts=0.0, now=0.02)
+    assert buffer.read(4, now=0.05) is None
+    out = buffer.read(12, now=0.1)
+    assert list(out) == [1] * 4 + [2] * 4 + [3] * 4
+    assert buffer.idle and buffer.dropped == 0
+
+
+def test_reads_split_chunks():
+    buffer = JitterBuffer(jitter=0.0, max_gap=1.0)
+    buffer.put(0, chunk(1), ts=0.0, now=0.0)
+    buffer.put(1, chunk(2), ts=0.0, now=0.0)
+    assert list(buffer.read(3, now=0.0)) == [1, 1, 1]
+    assert list(buffer.read(3, now=0.0)) == [1, 2, 2]
+    assert buffer.queued_samples() == 2
+
+
+def test_missing_chunk_is_skipped_after_max_gap():
+    buffer = JitterBuffer(jitter=0.0, max_gap=0.5)
+    buffer.put(0, chunk(1), ts=0.0, now=0.0)
+    buffer.put(3, chunk(4), ts=0.0, now=0.0)
+    assert list(buffer.read(4, now=0.0)) == [1] * 4
+    assert buffer.read(4, now=0.1) is None
+    assert buffer.read(4, now=0.4) is None
+    assert list(buffer.read(4, now=0.6)) == [4] * 4
+    assert buffer.dropped == 2
+
+
+def test_late_chunk_is_dropped():
+    buffer = JitterBuffer(jitter=0.0, max_gap=1.0)
+    buffer.put(5, chunk(1), ts=0.0, now=0.0)
+    buffer.put(6, chunk(2), ts=0.0, now=0.0)
+    buffer.read(4, now=0.0)
+    buffer.put(4, chunk(9), ts=0.0, now=0.1)
+    assert buffer.dropped == 1
+    assert list(buffer.read(8, now=0.1)) == [2] * 4
+
+
+def test_new_utterance_restarts_the_sequence():
+    buffer = JitterBuffer(jitter=0.0, max_gap=1.0)
+    buffer.put(7, chunk(1), ts=0.0, now=0.0)
+    buffer.read(4, now=0.0)
+    buffer.put(0, chunk(2), ts=0.0, now=1.0)
+    assert list(buffer.read(4, now=1.0)) == [2] * 4
+    assert buffer.dropped == 0
+
+
+def test_played_traces_are_stamped():
+    played = []
+    buffer = JitterBuffer(jitter=0.0, max_gap=1.0, played=played)
+    buffer.put(0, chunk(1), ts=0.0, now=0.0, trace={'id': 't'})
+    buffer.read(4, now=2.0)
+    assert played == [{'id': 't', 'play': 2.0}]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(playback.time, 'time', clock)
+    return clock
+
+
+def test_player_queues_speakers_unless_mixing(clock):
+    player = Player(sample_rate=8000, jitter_ms=0, max_gap_ms=500, mix=False)
+    player.put('a', 0, chunk(0.25), 8000, ts=clock.now)
+    player.put('b', 0, chunk(0.5), 8000, ts=clock.now)
+    assert list(player.render(4)) == [0.25] * 4
+    assert list(player.render(4)) == [0.5] * 4
+
+    player = Player(sample_rate=8000, jitter_ms=0, max_gap_ms=500, mix=True)
+    player.put('a', 0, chunk(0.25), 8000, ts=clock.now)
+    player.put('b', 0, chunk(0.5), 8000, ts=clock.now)
+    assert list(player.render(4)) == [0.75] * 4
+
+
+def test_player_resamples_to_the_output_rate(clock):
+    player = Player(sample_rate=16000, jitter_ms=0, max_gap_ms=500)
+    player.put('a', 0, chunk(0.5, 8), 8000, ts=clock.now)
+    assert player.stats()['queued_seconds'] == pytest.approx(0.001)
+
+
+def test_player_evicts_stale_speakers_and_keeps_their_drops(clock):
+    player = Player(sample_rate=8000, jitter_ms=0, max_gap_ms=500)
+    player.put('a', 0, chunk(0.5), 8000, ts=clock.now)
+    player.put('a', 2, chunk(0.5), 8000, ts=clock.now)
+    player.render(4)
+    # The gap is noticed once chunk 0 is through, and skipped max_gap later
+    player.render(4)
+    clock.now += 0.6
+    player.render(4)
+    assert player.stats()['dropped'] == 1
+    clock.now += 0.6
+    player.render(4)
+    assert 'a' not in player._buffers
+    assert player.stats() == {'speakers': 0, 'queued_chunks': 0,
+                              'queued_seconds': 0.0, 'dropped': 1}
@@ -0,0 +1,87 @@
+import asyncio
+
+import numpy as np
+
+from src.audio import SAMPLE_RATE
+from src.streaming import HypothesisBuffer, StreamingSession
+
+
+def words(*items):
+    return [(start, start + 0.4, text) for start, text in items]
+
+
+def test_commits_only_what_two_hypotheses_agree_on():
+    buffer = HypothesisBuffer()
+    buffer.insert(words((0.0, ' hello'), (0.5, ' word')), 0.0)
+    assert buffer.flush() == []
+
+    buffer.insert(words((0.0, ' hello'), (0.5, ' world'), (1.0, ' again')), 0.0)
+    assert [w[2] for w in buffer.flush()] == [' hello']
+    assert [w[2] for w in buffer.complete()] == [' world', ' again']
+    assert buffer.last_committed_time == 0.4
+
+
+def test_agreement_ignores_case_and_punctuation():
+    buffer = HypothesisBuffer()
+    buffer.insert(words((0.0, ' Hello,')), 0.0)
+    buffer.flush()
+    buffer.insert(words((0.0, ' hello')), 0.0)
+    assert [w[2] for w in buffer.flush()] == [' hello']
+
+
+def test_repeated_committed_tail_is_dropped():
+    buffer = HypothesisBuffer()
+    for _ in range(2):
+        buffer.insert(words((0.0, ' one'), (0.5, ' two')), 0.0)
+        buffer.flush()
+    # The decoder starts over with words that were already committed
+    buffer.insert(words((0.5, ' two'), (1.0, ' three')), 0.0)
+    assert [w[2] for w in buffer.new] == [' three']
+
+
+def test_offset_makes_word_times_absolute():
+    buffer = HypothesisBuffer()
+    buffer.insert(words((0.0, ' late')), 10.0)
+    assert buffer.new[0][:2] == (10.0, 10.4)
+
+
+class FakeDecoder:
+    """ Returns the scripted hypotheses one call after another. """
+
+    def __init__(self, *hypotheses):
+        self.hypotheses = list(hypotheses)
+        self.prompts = []
+
+    async def __call__(self, audio, prompt):
+        self.prompts.append(prompt)
+        return self.hypotheses.pop(0)
+
+
+def chunk(seconds=0.5):
+    return np.zeros(int(seconds * SAMPLE_RATE), dtype=np.float32)
+
+
+def test_session_hands_on_finished_sentences():
+    decoder = FakeDecoder(
+        words((0.0, ' Good'), (0.4, ' morning.')),
+        words((0.0, ' Good'), (0.4, ' morning.'), (0.9, ' How')),
+        words((0.9, ' How'), (1.2, ' are'), (1.5, ' you')))
+    session = StreamingSession(decoder)
+
+    committed, partial, sentences = asyncio.run(session.feed(chunk(), False))
+    assert (committed, partial, sentences) == ('', 'Good morning.', [])
+
+    committed, partial, sentences = asyncio.run(session.feed(chunk(), False))
+    assert committed == 'Good morning.'
+    assert partial == 'How'
+    assert sentences == ['Good morning.']
+    # The audio before the last committed word is trimmed
+    assert session.offset == 0.8
+
+    committed, partial, sentences = asyncio.run(session.feed(chunk(), True))
+    # Later decodes are prompted with the committed text
+    assert decoder.prompts == [None, None, ' Good morning.']
+    assert committed == 'How are you'
+    assert sentences == ['How are you']
+    # The last chunk resets the session for the next utterance
+    assert (session.committed, session.offset, len(session.audio)) == ('', 0.0, 0)
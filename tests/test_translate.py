@@ -0,0 +1,88 @@
+import asyncio
+
+from src.translate import (StubBackend, TranslationCache, Translator,
+                           build_prompt, normalize, parse_response)
+
+
+def translator(backend, **kwargs):
+    return Translator(backend, cache=TranslationCache(max_items=100), **kwargs)
+
+
+def test_prompt_lists_escaped_items_and_languages():
+    system, user = build_prompt(['a < b', 'hi'], ('zh', 'en'))
+    assert user == '<items><item id="0">a &lt; b</item><item id="1">hi</item></items>'
+    assert 'Chinese and English' in system
+    assert '"1": {"zh": "Translation in Chinese", "en": "Translation in English"}' \
+        in system
+
+
+def test_parse_response_fills_missing_items_and_languages():
+    reply = 'Sure: {"0": {"zh": "你好", "en": "hello"}, "2": {"en": "bye"}} done'
+    assert parse_response(reply, 3, ('zh', 'en')) == [
+        {'zh': '你好', 'en': 'hello'},
+        {'zh': '', 'en': ''},
+        {'zh': '', 'en': 'bye'},
+    ]
+
+
+def test_stub_backend_round_trips_the_prompt():
+    texts = ['one & two', '三']
+    system, user = build_prompt(texts, ('en',))
+    reply = StubBackend(latency=0).converse(system, user)
+    assert parse_response(reply, 2, ('en',)) == [{'en': t} for t in texts]
+
+
+def test_normalize_ignores_case_punctuation_and_spacing():
+    assert normalize('Yes.') == normalize('  yes ') == 'yes'
+    assert normalize('Ｈｅｌｌｏ,world！') == 'hello world'
+
+
+def test_queued_requests_are_batched_per_language_set():
+    backend = StubBackend(latency=0.05)
+    t = translator(backend, max_batch=3, concurrency=1)
+
+    async def run():
+        return await asyncio.gather(
+            *(t.translate(f'text {i}', ('zh', 'en')) for i in range(5)),
+            t.translate('only english', ('en',)))
+
+    results = asyncio.run(run())
+    assert results[:5] == [{'zh': f'text {i}', 'en': f'text {i}'}
+                           for i in range(5)]
+    assert results[5] == {'en': 'only english'}
+    # 5 same-language requests at 3 per batch, plus the English one alone
+    assert backend.calls == 3
+
+
+def test_cache_hits_skip_the_backend():
+    backend = StubBackend(latency=0)
+    t = translator(backend)
+
+    async def run():
+        first = await t.translate('Hello.', ('en',))
+        second = await t.translate('hello', ('en',))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert second == first == {'en': 'Hello.'}
+    assert backend.calls == 1
+    assert t.cache.stats()['hits'] == 1
+
+
+class FailingBackend:
+    calls = 0
+
+    def converse(self, system, text):
+        self.calls += 1
+        raise RuntimeError('throttled')
+
+
+def test_failures_give_empty_translations_that_are_not_cached():
+    backend = FailingBackend()
+    t = translator(backend)
+
+    async def run():
+        return [await t.translate('hi', ('zh', 'en')) for _ in range(2)]
+
+    assert asyncio.run(run()) == [{'zh': '', 'en': ''}] * 2
+    assert backend.calls == 2
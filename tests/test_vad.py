@@ -0,0 +1,79 @@
+from io import BytesIO
+
+import pytest
+
+from src.vad import VadSegmenter, to_wav, wav_frames
+
+RATE = 8000
+FRAME_BYTES = RATE * 30 // 1000 * 2
+
+
+def frame(index, voiced):
+    """ A frame that records its position and whether it is speech. """
+    head = bytes([voiced]) + index.to_bytes(2, 'little')
+    return head + bytes(FRAME_BYTES - len(head))
+
+
+def indices(pcm):
+    return [int.from_bytes(pcm[i + 1:i + 3], 'little')
+            for i in range(0, len(pcm), FRAME_BYTES)]
+
+
+def segmenter(**kwargs):
+    kwargs.setdefault('window', 4)
+    return VadSegmenter(sample_rate=RATE, is_speech=lambda f: f[0] == 1,
+                        **kwargs)
+
+
+def frames(pattern):
+    """ Frames of a '0'/'1' voicing pattern. """
+    return [frame(i, c == '1') for i, c in enumerate(pattern)]
+
+
+def test_utterance_starts_and_stops_on_the_window_ratio():
+    vad = segmenter()
+    out = []
+    for f in frames('0000' + '111111' + '000'):
+        was = vad.triggered
+        pcm = vad.push(f)
+        out.append((was, vad.triggered, pcm))
+    # Triggered on the third voiced frame, > half of a 4 frame window
+    assert [i for i, (was, now, _) in enumerate(out) if now and not was] == [6]
+    ends = [(i, pcm) for i, (_, _, pcm) in enumerate(out) if pcm is not None]
+    assert len(ends) == 1
+    end, pcm = ends[0]
+    assert end == 12
+    # Keeps the window of audio before the trigger, through the silence
+    assert indices(pcm) == list(range(3, 13))
+
+
+def test_silence_yields_nothing():
+    vad = segmenter()
+    assert list(vad.segments(frames('0' * 50))) == []
+
+
+def test_long_speech_is_cut_without_losing_frames():
+    vad = segmenter(max_seconds=0.3)
+    segments = list(vad.segments(frames('1' * 35)))
+    assert [len(s) // FRAME_BYTES for s in segments] == [10, 10, 10, 5]
+    assert [i for s in segments for i in indices(s)] == list(range(35))
+
+
+def test_flush_returns_the_utterance_in_progress():
+    vad = segmenter()
+    for f in frames('1111'):
+        vad.push(f)
+    assert indices(vad.flush()) == [0, 1, 2, 3]
+    assert not vad.triggered
+    assert vad.flush() is None
+
+
+def test_wrong_frame_size_is_rejected():
+    with pytest.raises(ValueError):
+        segmenter().push(b'\x00' * (FRAME_BYTES - 2))
+
+
+def test_wav_frames_round_trip_drops_partial_frame():
+    pcm = b''.join(frames('0101')) + b'\x01\x00'
+    source = BytesIO(to_wav(pcm, RATE))
+    assert list(wav_frames(source, FRAME_BYTES // 2)) == frames('0101')
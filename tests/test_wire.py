@@ -0,0 +1,58 @@
+import pytest
+
+from src import codec, wire
+from src.audio import encode_wav
+
+
+def test_pack_unpack_round_trip():
+    trace = {'id': 'abc', 'capture': 1.5}
+    blob = wire.pack(b'payload', seq=7, last=False, ts=123.25,
+                     codec=codec.FLAC, sample_rate=16000, stream=True,
+                     trace=trace)
+    frame = wire.unpack(blob)
+    assert frame == wire.Frame(7, False, 123.25, b'payload', codec.FLAC,
+                               16000, True, trace)
+
+
+def test_frame_without_trace_carries_none():
+    frame = wire.unpack(wire.pack(b'x', seq=1))
+    assert frame.trace is None
+    assert frame.last and not frame.stream
+    assert frame.payload == b'x'
+
+
+def test_legacy_blob_is_a_single_wav_chunk():
+    blob = encode_wav([0.0] * 10, 16000)
+    frame = wire.unpack(blob)
+    assert (frame.seq, frame.last, frame.ts, frame.codec) == (0, True, 0.0, codec.WAV)
+    assert frame.payload == blob
+    assert wire.peek_seq(blob) is None
+
+
+def test_seq_wraps_to_32_bits_and_peeks_without_decoding():
+    blob = wire.pack(b'', seq=2 ** 32 + 5, trace={'id': 't'})
+    assert wire.unpack(blob).seq == 5
+    assert wire.peek_seq(blob) == 5
+
+
+def test_restamp_adds_a_stage_and_keeps_the_frame():
+    blob = wire.pack(b'audio', seq=3, ts=10.0, codec=codec.PCM,
+                     sample_rate=24000, trace={'id': 't'})
+    frame = wire.unpack(wire.restamp(blob, 'enqueue', ts=11.0))
+    assert frame.trace == {'id': 't', 'enqueue': 11.0}
+    assert (frame.seq, frame.ts, frame.payload, frame.sample_rate) == \
+        (3, 10.0, b'audio', 24000)
+
+
+def test_restamp_leaves_untraced_frames_alone():
+    blob = wire.pack(b'audio')
+    assert wire.restamp(blob, 'enqueue') is blob
+
+
+def test_decode_uses_the_frame_sample_rate():
+    samples = [0.5, -0.25, 0.0] * 20
+    blob = wire.pack(codec.encode(samples, 8000, codec.PCM), codec=codec.PCM,
+                     sample_rate=8000)
+    frame, decoded = wire.decode(blob, 16000)
+    assert frame.sample_rate == 8000
+    assert list(decoded) == pytest.approx(samples, abs=1e-3)